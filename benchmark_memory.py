@@ -0,0 +1,117 @@
+import gc
+import json
+import time
+import random
+import datetime
+import argparse
+import tracemalloc
+
+from modules import utils
+from modules.maze import Maze
+from modules.memory.associate import Concept
+from modules.storage.vector_store import Node
+
+
+# 生成合成地圖：每個街區一個區域，每個區域內有一個房間與若干物品
+def synthetic_maze(size, block=20):
+    tiles = []
+    for y in range(size):
+        for x in range(size):
+            coord = [x, y]
+            if x in (0, size - 1) or y in (0, size - 1):
+                tiles.append({"coord": coord, "collision": True})
+                continue
+            sector = "sector_{}_{}".format(x // (block * 4), y // (block * 4))
+            lx, ly = x % block, y % block
+            if 4 <= lx <= 15 and 4 <= ly <= 15:
+                arena = "room_{}_{}".format(x // block, y // block)
+                if lx in (4, 15) or ly in (4, 15):
+                    tiles.append({"coord": coord, "collision": ly != 15 or lx != 10})
+                    continue
+                address = [sector, arena]
+                if lx in (6, 7) and ly in (6, 7):
+                    address.append("bed")
+                elif lx == 12 and ly == 6:
+                    address.append("desk")
+                tiles.append({"coord": coord, "address": address})
+            else:
+                tiles.append({"coord": coord, "address": [sector]})
+    return {
+        "size": [size, size],
+        "tile_size": 32,
+        "world": "the Ville",
+        "tile_address_keys": ["world", "sector", "arena", "game_object"],
+        "tiles": tiles,
+    }
+
+
+# 測量建構物件的耗時，以及建構時新增的記憶體（追蹤記憶體會拖慢速度，故分開測量）
+def measure(name, build):
+    # 兩次建構都從空的日期快取開始
+    gc.collect()
+    utils.to_date.cache_clear()
+    start = time.time()
+    build()
+    duration = time.time() - start
+    gc.collect()
+    utils.to_date.cache_clear()
+    tracemalloc.start()
+    result = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        "{:<24} {:>10.1f} MB {:>10.1f} MB(peak) {:>8.2f}s".format(
+            name, current / 1024 / 1024, peak / 1024 / 1024, duration
+        )
+    )
+    return result
+
+
+# 每個概念的時間與描述都不同，避免日期快取與字串共用讓結果過於樂觀
+def build_concepts(count, seed=0):
+    rng = random.Random(seed)
+    subjects = ["盧品蓉", "李昇峰", "游庭瑄", "莊于萱", "鄭傑丞", "陳冠佑", "蔡宗陞", "魏祺紘"]
+    objects = ["閱讀", "寫作業", "吃早餐", "散步", "聊天", "打掃房間", "準備報告", "運動"]
+    places = ["宿舍:{}的房間:書桌", "咖啡廳:座位", "圖書館:閱覽區", "公園:長椅"]
+    start = datetime.datetime(2024, 2, 13, 9, 30)
+    nodes = []
+    for i in range(count):
+        subject, obj = rng.choice(subjects), rng.choice(objects)
+        create = start + datetime.timedelta(seconds=rng.randrange(30 * 24 * 3600))
+        access = create + datetime.timedelta(seconds=rng.randrange(24 * 3600))
+        metadata = {
+            "node_type": rng.choice(["event", "thought", "chat"]),
+            "subject": subject,
+            "predicate": "此時",
+            "object": obj,
+            "address": "the Ville:" + rng.choice(places).format(subject),
+            "poignancy": rng.randint(1, 10),
+            "create": create.strftime("%Y%m%d-%H:%M:%S"),
+            "expire": (create + datetime.timedelta(days=30)).strftime("%Y%m%d-%H:%M:%S"),
+            "access": access.strftime("%Y%m%d-%H:%M:%S"),
+        }
+        describe = "{} 正在{}（第 {} 次）".format(subject, obj, i)
+        nodes.append(Node("node_" + str(i), describe, metadata))
+    # 只計算概念本身，節點在量測前建好
+    return lambda: [Concept.from_node(n) for n in nodes]
+
+
+parser = argparse.ArgumentParser(description="memory benchmark of the maze and memory objects")
+parser.add_argument("--maze", type=str, default="frontend/static/assets/village/maze.json", help="The maze config")
+parser.add_argument("--size", type=int, default=1000, help="The size of the synthetic maze, 0 to skip")
+parser.add_argument("--concepts", type=int, default=100000, help="Number of concepts to create")
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+    utils.set_timer("20240213-09:30")
+    with open(args.maze, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    maze = measure("maze {}x{}".format(*config["size"][::-1]), lambda: Maze(config, None))
+    del maze
+    if args.size > 0:
+        config = synthetic_maze(args.size)
+        maze = measure("maze {0}x{0}".format(args.size), lambda: Maze(config, None))
+        del maze, config
+    if args.concepts > 0:
+        concepts = measure("concepts x{}".format(args.concepts), build_concepts(args.concepts))
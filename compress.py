@@ -5,6 +5,8 @@ import collections
 from datetime import datetime
 
 from modules.maze import Maze
+from modules.storage.checkpoint import CheckpointReader
+from modules.storage.conversation import load_conversation
 from start import load_personas_from_config
 
 # 載入AI居民列表
@@ -17,14 +19,11 @@ frames_per_step = 60  # 每個step包含的幀數
 
 
 # 從存檔文件中讀取stride
-def get_stride(json_files):
-    if len(json_files) < 1:
+def get_stride(reader):
+    if len(reader) < 1:
         return 1
 
-    with open(json_files[-1], "r", encoding="utf-8") as f:
-        config = json.load(f)
-
-    return config["stride"]
+    return reader.latest()["stride"]
 
 
 # 將address轉換為字符串
@@ -66,15 +65,7 @@ def extract_interaction_data(checkpoints_folder):
     object_interactions = collections.defaultdict(int)
     location_interactions = collections.defaultdict(int)
     
-    conversation_file = "conversation.json"
-    files = sorted(os.listdir(checkpoints_folder))
-    json_files = [f for f in files if f.endswith(".json") and f != conversation_file]
-    
-    for file_name in json_files:
-        file_path = os.path.join(checkpoints_folder, file_name)
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            
+    for data in CheckpointReader(checkpoints_folder):
         for agent_name, agent_data in data.get("agents", {}).items():
             action = agent_data.get("action", {})
             
@@ -100,24 +91,16 @@ def extract_interaction_data(checkpoints_folder):
 def generate_movement(checkpoints_folder, compressed_folder, compressed_file):
     movement_file = os.path.join(compressed_folder, compressed_file)
 
-    conversation_file = "conversation.json"
-    conversation = {}
-    if os.path.exists(os.path.join(checkpoints_folder, conversation_file)):
-        with open(os.path.join(checkpoints_folder, conversation_file), "r", encoding="utf-8") as f:
-            conversation = json.load(f)
+    conversation = load_conversation(checkpoints_folder)
 
-    files = sorted(os.listdir(checkpoints_folder))
-    json_files = list()
-    for file_name in files:
-        if file_name.endswith(".json") and file_name != conversation_file:
-            json_files.append(os.path.join(checkpoints_folder, file_name))
+    reader = CheckpointReader(checkpoints_folder)
 
     persona_init_pos = dict()
     all_movement = dict()
     all_movement["description"] = dict()
     all_movement["conversation"] = dict()
 
-    stride = get_stride(json_files)
+    stride = get_stride(reader)
     sec_per_step = stride
 
     result = {
@@ -136,89 +119,87 @@ def generate_movement(checkpoints_folder, compressed_folder, compressed_file):
         json_data = json.load(f)
         maze = Maze(json_data, None)
 
-    for file_name in json_files:
-        # 依次讀取所有存檔文件
-        with open(file_name, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
-            step = json_data["step"]
-            agents = json_data["agents"]
-
-            # 保存回放的起始時間
-            if len(result["start_datetime"]) < 1:
-                t = datetime.strptime(json_data["time"], "%Y%m%d-%H:%M")
-                result["start_datetime"] = t.isoformat()
-
-            # 遍歷單個存檔文件中的所有Agent
-            for agent_name, agent_data in agents.items():
-                # 插入第0幀
-                if step == 1:
-                    insert_frame0(persona_init_pos, all_movement, agent_name)
-
-                source_coord = last_location.get(agent_name, all_movement["0"][agent_name])["movement"]
-                target_coord = agent_data["coord"]
-                location = get_location(agent_data["action"]["event"]["address"])
-                if location is None:
-                    location = last_location.get(agent_name, all_movement["0"][agent_name])["location"]
-                    path = [source_coord]
+    # 依次讀取所有存檔的狀態
+    for json_data in reader:
+        step = json_data["step"]
+        agents = json_data["agents"]
+
+        # 保存回放的起始時間
+        if len(result["start_datetime"]) < 1:
+            t = datetime.strptime(json_data["time"], "%Y%m%d-%H:%M")
+            result["start_datetime"] = t.isoformat()
+
+        # 遍歷單個存檔文件中的所有Agent
+        for agent_name, agent_data in agents.items():
+            # 插入第0幀
+            if step == 1:
+                insert_frame0(persona_init_pos, all_movement, agent_name)
+
+            source_coord = last_location.get(agent_name, all_movement["0"][agent_name])["movement"]
+            target_coord = agent_data["coord"]
+            location = get_location(agent_data["action"]["event"]["address"])
+            if location is None:
+                location = last_location.get(agent_name, all_movement["0"][agent_name])["location"]
+                path = [source_coord]
+            else:
+                path = maze.find_path(source_coord, target_coord)
+
+            had_conversation = False
+            step_conversation = ""
+            persons_in_conversation = []
+            step_time = json_data["time"]
+            if step_time in conversation.keys():
+                for chats in conversation[step_time]:
+                    for persons, chat in chats.items():
+                        persons_in_conversation.append(persons.split(" @ ")[0].split(" -> "))
+                        step_conversation += f"\n地點：{persons.split(' @ ')[1]}\n\n"
+                        for c in chat:
+                            agent = c[0]
+                            text = c[1]
+                            step_conversation += f"{agent}：{text}\n"
+
+            for i in range(frames_per_step):
+                moving = len(path) > 1
+                if len(path) > 0:
+                    movement = list(path[0])
+                    path = path[1:]
+                    if agent_name not in last_location.keys():
+                        last_location[agent_name] = dict()
+                    last_location[agent_name]["movement"] = movement
+                    last_location[agent_name]["location"] = location
                 else:
-                    path = maze.find_path(source_coord, target_coord)
-
-                had_conversation = False
-                step_conversation = ""
-                persons_in_conversation = []
-                step_time = json_data["time"]
-                if step_time in conversation.keys():
-                    for chats in conversation[step_time]:
-                        for persons, chat in chats.items():
-                            persons_in_conversation.append(persons.split(" @ ")[0].split(" -> "))
-                            step_conversation += f"\n地點：{persons.split(' @ ')[1]}\n\n"
-                            for c in chat:
-                                agent = c[0]
-                                text = c[1]
-                                step_conversation += f"{agent}：{text}\n"
-
-                for i in range(frames_per_step):
-                    moving = len(path) > 1
-                    if len(path) > 0:
-                        movement = list(path[0])
-                        path = path[1:]
-                        if agent_name not in last_location.keys():
-                            last_location[agent_name] = dict()
-                        last_location[agent_name]["movement"] = movement
-                        last_location[agent_name]["location"] = location
-                    else:
-                        movement = None
-
-                    if moving:
-                        action = f"前往 {location}"
-                    elif movement is not None:
-                        action = agent_data["action"]["event"]["describe"]
-                        if len(action) < 1:
-                            action = f'{agent_data["action"]["event"]["predicate"]}{agent_data["action"]["event"]["object"]}'
-
-                        # 判斷該存檔文件中當前Agent是否有新的對話（用於設置圖標）
-                        for persons in persons_in_conversation:
-                            if agent_name in persons:
-                                had_conversation = True
-                                break
-
-                        # 針對睡覺和對話設置圖標
-                        if "睡覺" in action:
-                            action = "😴 " + action
-                        elif had_conversation:
-                            action = "💬 " + action
-
-                    step_key = "%d" % ((step-1) * frames_per_step + 1 + i)
-                    if step_key not in all_movement.keys():
-                        all_movement[step_key] = dict()
-
-                    if movement is not None:
-                        all_movement[step_key][agent_name] = {
-                            "location": location,
-                            "movement": movement,
-                            "action": action,
-                        }
-                all_movement["conversation"][step_time] = step_conversation
+                    movement = None
+
+                if moving:
+                    action = f"前往 {location}"
+                elif movement is not None:
+                    action = agent_data["action"]["event"]["describe"]
+                    if len(action) < 1:
+                        action = f'{agent_data["action"]["event"]["predicate"]}{agent_data["action"]["event"]["object"]}'
+
+                    # 判斷該存檔文件中當前Agent是否有新的對話（用於設置圖標）
+                    for persons in persons_in_conversation:
+                        if agent_name in persons:
+                            had_conversation = True
+                            break
+
+                    # 針對睡覺和對話設置圖標
+                    if "睡覺" in action:
+                        action = "😴 " + action
+                    elif had_conversation:
+                        action = "💬 " + action
+
+                step_key = "%d" % ((step-1) * frames_per_step + 1 + i)
+                if step_key not in all_movement.keys():
+                    all_movement[step_key] = dict()
+
+                if movement is not None:
+                    all_movement[step_key][agent_name] = {
+                        "location": location,
+                        "movement": movement,
+                        "action": action,
+                    }
+            all_movement["conversation"][step_time] = step_conversation
     object_interactions, location_interactions = extract_interaction_data(checkpoints_folder)
     
     # 轉換為前端需要的格式
@@ -245,11 +226,7 @@ def generate_movement(checkpoints_folder, compressed_folder, compressed_file):
 def generate_report(checkpoints_folder, compressed_folder, compressed_file):
     last_state = dict()
 
-    conversation_file = "conversation.json"
-    conversation = {}
-    if os.path.exists(os.path.join(checkpoints_folder, conversation_file)):
-        with open(os.path.join(checkpoints_folder, conversation_file), "r", encoding="utf-8") as f:
-            conversation = json.load(f)
+    conversation = load_conversation(checkpoints_folder)
 
     def extract_description():
         markdown_content = "# 基礎人設\n\n"
@@ -307,16 +284,9 @@ def generate_report(checkpoints_folder, compressed_folder, compressed_file):
         return markdown_content
 
     all_markdown_content = extract_description()
-    files = sorted(os.listdir(checkpoints_folder))
-    for file_name in files:
-        if (not file_name.endswith(".json")) or (file_name == conversation_file):
-            continue
-
-        file_path = os.path.join(checkpoints_folder, file_name)
-        with open(file_path, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
-            content = extract_action(json_data)
-            all_markdown_content += content + "\n\n"
+    for json_data in CheckpointReader(checkpoints_folder):
+        content = extract_action(json_data)
+        all_markdown_content += content + "\n\n"
     with open(f"{compressed_folder}/{compressed_file}", "w", encoding="utf-8") as compressed_file:
         compressed_file.write(all_markdown_content)
 
@@ -1,7 +1,6 @@
 """generative_agents.agent"""
 
 import os
-import math
 import random
 import datetime
 
@@ -11,10 +10,11 @@ from modules.memory.associate import Concept
 
 
 class Agent:
-    def __init__(self, config, maze, conversation, logger):
+    def __init__(self, config, maze, conversation, logger, conversation_log=None):
         self.name = config["name"]
         self.maze = maze
         self.conversation = conversation
+        self.conversation_log = conversation_log
         self._llm = None
         self.logger = logger
 
@@ -90,16 +90,39 @@ class Agent:
             self._llm = create_llm_model(**self.think_config["llm"], keys=keys)
 
     def completion(self, func_hint, *args, **kwargs):
+        prompt, responses = self._make_prompt(func_hint, *args, **kwargs), []
+        if self.llm_available():
+            self.logger.info("{} -> {}".format(self.name, func_hint))
+            output = self._llm.completion(
+                **prompt, caller=func_hint, meta_responses=responses
+            )
+        else:
+            output = prompt.get("failsafe")
+        return self._log_completion(func_hint, prompt, output, responses)
+
+    async def acompletion(self, func_hint, *args, **kwargs):
+        """Async version of completion, to fan out llm calls from one event loop"""
+
+        prompt, responses = self._make_prompt(func_hint, *args, **kwargs), []
+        if self.llm_available():
+            self.logger.info("{} -> {}".format(self.name, func_hint))
+            output = await self._llm.acompletion(
+                **prompt, caller=func_hint, meta_responses=responses
+            )
+        else:
+            output = prompt.get("failsafe")
+        return self._log_completion(func_hint, prompt, output, responses)
+
+    def _make_prompt(self, func_hint, *args, **kwargs):
         assert hasattr(
             self.scratch, "prompt_" + func_hint
         ), "Can not find func prompt_{} from scratch".format(func_hint)
         func = getattr(self.scratch, "prompt_" + func_hint)
-        prompt = func(*args, **kwargs)
+        return func(*args, **kwargs)
+
+    def _log_completion(self, func_hint, prompt, output, responses):
         title, msg = "{}.{}".format(self.name, func_hint), {}
         if self.llm_available():
-            self.logger.info("{} -> {}".format(self.name, func_hint))
-            output = self._llm.completion(**prompt, caller=func_hint)
-            responses = self._llm.meta_responses
             msg = {"<PROMPT>": "\n" + prompt["prompt"] + "\n"}
             msg.update(
                 {
@@ -107,8 +130,6 @@ class Agent:
                     for idx, r in enumerate(responses)
                 }
             )
-        else:
-            output = prompt.get("failsafe")
         msg["<OUTPUT>"] = "\n" + str(output) + "\n"
         self.logger.debug(utils.block_msg(title, msg))
         return output
@@ -117,24 +138,8 @@ class Agent:
         events = self.move(status["coord"], status.get("path"))
         plan, _ = self.make_schedule()
 
-        if (plan["describe"] == "sleeping" or "睡" in plan["describe"]) and self.is_awake():
-            self.logger.info("{} is going to sleep...".format(self.name))
-            address = self.spatial.find_address("睡覺", as_list=True)
-            tiles = self.maze.get_address_tiles(address)
-            coord = random.choice(list(tiles))
-            events = self.move(coord)
-            self.action = memory.Action(
-                memory.Event(self.name, "正在", "睡覺", address=address, emoji="😴"),
-                memory.Event(
-                    address[-1],
-                    "被占用",
-                    self.name,
-                    address=address,
-                    emoji="🛌",
-                ),
-                duration=plan["duration"],
-                start=utils.get_timer().daily_time(plan["start"]),
-            )
+        if self.should_sleep(plan):
+            events = self.go_sleep(plan)
         if self.is_awake():
             self.percept()
             self.make_plan(agents)
@@ -142,7 +147,32 @@ class Agent:
         else:
             if self.action.finished():
                 self.action = self._determine_action()
+        return self.finish_think(events, agents)
+
+    def should_sleep(self, plan):
+        return (plan["describe"] == "sleeping" or "睡" in plan["describe"]) and self.is_awake()
+
+    def go_sleep(self, plan):
+        self.logger.info("{} is going to sleep...".format(self.name))
+        address = self.spatial.find_address("睡覺", as_list=True)
+        tiles = self.maze.get_address_tiles(address)
+        coord = random.choice(list(tiles))
+        events = self.move(coord)
+        self.action = memory.Action(
+            memory.Event(self.name, "正在", "睡覺", address=address, emoji="😴"),
+            memory.Event(
+                address[-1],
+                "被占用",
+                self.name,
+                address=address,
+                emoji="🛌",
+            ),
+            duration=plan["duration"],
+            start=utils.get_timer().daily_time(plan["start"]),
+        )
+        return events
 
+    def finish_think(self, events, agents):
         emojis = {}
         if self.action:
             emojis[self.name] = {"emoji": self.get_event().emoji, "coord": self.coord}
@@ -164,8 +194,8 @@ class Agent:
             tile = self.maze.tile_at(coord)
             if not self.action:
                 return {}
-            if not tile.update_events(self.get_event()):
-                tile.add_event(self.get_event())
+            if not self.maze.update_events(coord, self.get_event()):
+                self.maze.add_event(coord, self.get_event())
             obj_event = self.get_event(False)
             if obj_event:
                 self.maze.update_obj(coord, obj_event)
@@ -173,7 +203,7 @@ class Agent:
 
         if self.coord and self.coord != coord:
             tile = self.get_tile()
-            tile.remove_events(subject=self.name)
+            self.maze.remove_events(self.coord, subject=self.name)
             if tile.has_address("game_object"):
                 addr = tile.get_address("game_object")
                 self.maze.update_obj(
@@ -278,39 +308,39 @@ class Agent:
             )
 
     def percept(self):
-        scope = self.maze.get_scope(self.coord, self.percept_config)
         # add spatial memory
-        for tile in scope:
-            if tile.has_address("game_object"):
-                self.spatial.add_leaf(tile.address)
-        events, arena = {}, self.get_tile().get_address("arena")
+        for address in self.maze.get_scope_objects(self.coord, self.percept_config):
+            self.spatial.add_leaf(address)
         # gather events in scope
-        for tile in scope:
-            if not tile.events or tile.get_address("arena") != arena:
-                continue
-            dist = math.dist(tile.coord, self.coord)
-            for event in tile.get_events():
-                if dist < events.get(event, float("inf")):
-                    events[event] = dist
+        arena = self.get_tile().get_address("arena")
+        events = self.maze.get_scope_events(self.coord, self.percept_config, arena)
         events = list(sorted(events.keys(), key=lambda k: events[k]))
         # get concepts
-        self.concepts, valid_num = [], 0
+        self.concepts, new_events, perceived = [], [], set()
         for idx, event in enumerate(events[: self.percept_config["att_bandwidth"]]):
-            recent_nodes = (
-                self.associate.retrieve_events() + self.associate.retrieve_chats()
-            )
-            recent_nodes = set(n.describe for n in recent_nodes)
-            if event.get_describe() not in recent_nodes:
-                if event.object == "idle" or event.object == "空閒":
-                    node = Concept.from_event(
-                        "idle_" + str(idx), "event", event, poignancy=1
-                    )
-                else:
-                    valid_num += 1
-                    node_type = "chat" if event.fit(self.name, "對話") else "event"
-                    node = self._add_concept(node_type, event)
-                    self.status["poignancy"] += node.poignancy
-                self.concepts.append(node)
+            describe = event.get_describe()
+            if describe in perceived or self.associate.is_recent(describe):
+                continue
+            if event.object == "idle" or event.object == "空閒":
+                self.concepts.append(
+                    Concept.from_event("idle_" + str(idx), "event", event, poignancy=1)
+                )
+            else:
+                # new concepts count as recent for the rest of this pass
+                perceived.add(describe)
+                node_type = "chat" if event.fit(self.name, "對話") else "event"
+                new_events.append((node_type, event))
+                self.concepts.append(len(new_events) - 1)
+        # score the new events in one completion, then keep the percept order
+        scores = self._poignancy_batch(new_events)
+        for i, concept in enumerate(self.concepts):
+            if isinstance(concept, int):
+                node_type, event = new_events[concept]
+                self.concepts[i] = self._add_concept(
+                    node_type, event, poignancy=scores[concept]
+                )
+                self.status["poignancy"] += self.concepts[i].poignancy
+        valid_num = len(new_events)
         self.concepts = [c for c in self.concepts if c.event.subject != self.name]
         self.logger.info(
             "{} percept {}/{} concepts".format(self.name, valid_num, len(self.concepts))
@@ -319,6 +349,9 @@ class Agent:
     def make_plan(self, agents):
         if self._reaction(agents):
             return
+        self.follow_plan()
+
+    def follow_plan(self):
         if self.path:
             return
         if self.action.finished():
@@ -416,14 +449,14 @@ class Agent:
                 return True
             return False
 
-        target_tiles = [t for t in target_tiles if not _ignore_target(t)]
-        if not target_tiles:
-            return []
-        if len(target_tiles) >= 4:
-            target_tiles = random.sample(target_tiles, 4)
-        pathes = {t: self.maze.find_path(self.coord, t) for t in target_tiles}
-        target = min(pathes, key=lambda p: len(pathes[p]))
-        return pathes[target][1:]
+        target_tiles = list(target_tiles)
+        occupied = [t for t in target_tiles if _ignore_target(t)]
+        # the tiles around another agent move, keep the cache for addresses,
+        # keyed by all their tiles as the occupied ones change every step
+        cache = address[0] != "<persona>"
+        return self.maze.find_nearest_path(
+            self.coord, target_tiles, cache=cache, exclude=occupied
+        )[1:]
 
     def _determine_action(self):
         self.logger.info("{} is determining action...".format(self.name))
@@ -466,6 +499,22 @@ class Agent:
         )
 
     def _reaction(self, agents=None, ignore_words=None):
+        reaction = self.decide_reaction(agents, ignore_words)
+        if not reaction:
+            return False
+        mode, other, _ = reaction
+        record = self.react(mode, other)
+        if record:
+            self.record_chat(*record)
+        return mode == "chat"
+
+    def decide_reaction(self, agents=None, ignore_words=None):
+        """Decide whether to chat with or wait for another agent, without acting.
+
+        Only this agent is changed, so the agents can decide concurrently.
+        Returns ("chat" or "wait", other, focus), or None to follow the plan.
+        """
+
         focus = None
         ignore_words = ignore_words or ["空閒"]
 
@@ -484,14 +533,32 @@ class Agent:
             if priority:
                 focus = random.choice(priority)
         if not focus or focus.event.subject not in agents:
-            return
+            return None
         other, focus = agents[focus.event.subject], self.associate.get_relation(focus)
 
-        if self._chat_with(other, focus):
-            return True
-        if self._wait_other(other, focus):
-            return True
-        return False
+        if self._decide_chat(other, focus):
+            return "chat", other, focus
+        if self._decide_wait(other, focus):
+            return "wait", other, focus
+        return None
+
+    def react(self, mode, other):
+        """Act on a reaction from decide_reaction, changing this agent and other.
+
+        Returns the arguments of record_chat for a chat, None for a wait.
+        """
+
+        if mode == "chat":
+            return self._chat_with(other)
+        self._wait_other(other)
+        return None
+
+    def record_chat(self, key, chat_key, chats):
+        if key not in self.conversation.keys():
+            self.conversation[key] = []
+        self.conversation[key].append({chat_key: chats})
+        if self.conversation_log:
+            self.conversation_log.append(key, chat_key, chats)
 
     def _skip_react(self, other):
         def _skip(event):
@@ -507,7 +574,7 @@ class Agent:
             return True
         return False
 
-    def _chat_with(self, other, focus):
+    def _decide_chat(self, other, focus):
         if len(self.schedule.daily_schedule) < 1 or len(other.schedule.daily_schedule) < 1:
             # initializing
             return False
@@ -531,8 +598,10 @@ class Agent:
 
         if not self.completion("decide_chat", self, other, focus, chats):
             return False
-
         self.logger.info("{} decides chat with {}".format(self.name, other.name))
+        return True
+
+    def _chat_with(self, other):
         start, chats = utils.get_timer().get_date(), []
         relations = [
             self.completion("summarize_relation", self, other.name),
@@ -583,9 +652,7 @@ class Agent:
                 break
 
         key = utils.get_timer().get_date("%Y%m%d-%H:%M")
-        if key not in self.conversation.keys():
-            self.conversation[key] = []
-        self.conversation[key].append({f"{self.name} -> {other.name} @ {'，'.join(self.get_event().address)}": chats})
+        chat_key = f"{self.name} -> {other.name} @ {'，'.join(self.get_event().address)}"
 
         self.logger.info(
             "{} and {} has chats\n  {}".format(
@@ -600,9 +667,9 @@ class Agent:
             chats, chat_summary, start, duration, other
         )
         other.schedule_chat(chats, chat_summary, start, duration, self)
-        return True
+        return key, chat_key, chats
 
-    def _wait_other(self, other, focus):
+    def _decide_wait(self, other, focus):
         if self._skip_react(other):
             return False
         if not self.path:
@@ -612,6 +679,9 @@ class Agent:
         if not self.completion("decide_wait", self, other, focus):
             return False
         self.logger.info("{} decides wait to {}".format(self.name, other.name))
+        return True
+
+    def _wait_other(self, other):
         start = utils.get_timer().get_date()
         # duration = other.action.end - start
         t = other.action.end - start
@@ -645,15 +715,10 @@ class Agent:
         create=None,
         expire=None,
         filling=None,
+        poignancy=None,
     ):
-        if event.fit(None, "is", "idle"):
-            poignancy = 1
-        elif event.fit(None, "此時", "空閒"):
-            poignancy = 1
-        elif e_type == "chat":
-            poignancy = self.completion("poignancy_chat", event)
-        else:
-            poignancy = self.completion("poignancy_event", event)
+        if poignancy is None:
+            poignancy = self._poignancy(e_type, event)
         self.logger.debug("{} add associate {}".format(self.name, event))
         return self.associate.add_node(
             e_type,
@@ -664,6 +729,30 @@ class Agent:
             filling=filling,
         )
 
+    def _poignancy(self, e_type, event):
+        if self._is_idle(event):
+            return 1
+        if e_type == "chat":
+            return self.completion("poignancy_chat", event)
+        return self.completion("poignancy_event", event)
+
+    def _poignancy_batch(self, items):
+        """Score the poignancy of (e_type, event) items, one by one if the batch fails"""
+
+        pending = [i for i, (_, event) in enumerate(items) if not self._is_idle(event)]
+        scores = {}
+        if len(pending) > 1:
+            batch = self.completion("poignancy_batch", [items[i] for i in pending])
+            if batch:
+                scores = dict(zip(pending, batch))
+        return [
+            scores[i] if i in scores else self._poignancy(e_type, event)
+            for i, (e_type, event) in enumerate(items)
+        ]
+
+    def _is_idle(self, event):
+        return event.fit(None, "is", "idle") or event.fit(None, "此時", "空閒")
+
     def get_tile(self):
         return self.maze.tile_at(self.coord)
 
@@ -2,11 +2,15 @@
 
 import os
 import copy
+from concurrent.futures import ThreadPoolExecutor
 
 from modules.utils import GenerativeAgentsMap, GenerativeAgentsKey
 from modules import utils
 from .maze import Maze
 from .agent import Agent
+from .storage.embedding import create_embedding_service
+from .storage.conversation import ConversationLog
+from .storage.writer import BackgroundWriter
 
 
 class Game:
@@ -16,9 +20,15 @@ class Game:
         self.name = name
         self.static_root = static_root
         self.record_iterval = config.get("record_iterval", 30)
+        self.think_workers = config.get("think_workers", 0)
+        self._executor = None
+        # checkpoints are serialized and written off the simulation thread
+        self.writer = BackgroundWriter(config.get("checkpoint_queue", 64))
+        GenerativeAgentsMap.set(GenerativeAgentsKey.WRITER, self.writer)
         self.logger = logger or utils.IOLogger()
         self.maze = Maze(self.load_static(config["maze"]["path"]), self.logger)
         self.conversation = conversation
+        self.conversation_log = ConversationLog(f"results/checkpoints/{name}")
         self.agents = {}
         if "agent_base" in config:
             agent_base = config["agent_base"]
@@ -27,6 +37,8 @@ class Game:
         storage_root = os.path.join(f"results/checkpoints/{name}", "storage")
         if not os.path.isdir(storage_root):
             os.makedirs(storage_root)
+        # agents with the same embedding config share one service and its cache
+        GenerativeAgentsMap.set(GenerativeAgentsKey.EMBEDDING, {})
         for name, agent in config["agents"].items():
             agent_config = utils.update_dict(
                 copy.deepcopy(agent_base), self.load_static(agent["config_path"])
@@ -34,7 +46,12 @@ class Game:
             agent_config = utils.update_dict(agent_config, agent)
 
             agent_config["storage_root"] = os.path.join(storage_root, name)
-            self.agents[name] = Agent(agent_config, self.maze, self.conversation, self.logger)
+            embedding = agent_config.get("associate", {}).get("embedding")
+            if embedding:
+                create_embedding_service(embedding, storage_root)
+            self.agents[name] = Agent(
+                agent_config, self.maze, self.conversation, self.logger, self.conversation_log
+            )
 
     def get_agent(self, name):
         return self.agents[name]
@@ -42,6 +59,87 @@ class Game:
     def agent_think(self, name, status):
         agent = self.get_agent(name)
         plan = agent.think(status, self.agents)
+        return {"plan": plan, "info": self._think_info(agent)}
+
+    def agents_think(self, status):
+        """Think for all agents in one step, running the llm bound stages concurrently.
+
+        Maze mutations (moves) are applied in agent order between the concurrent
+        stages, so the maze never changes while agents read it. Reactions are
+        decided concurrently and committed by _react.
+        """
+
+        agents = [self.get_agent(name) for name in status]
+        events = {
+            a.name: a.move(status[a.name]["coord"], status[a.name].get("path"))
+            for a in agents
+        }
+        plans = self._map(lambda a: a.make_schedule()[0], agents)
+        for agent, plan in zip(agents, plans):
+            if agent.should_sleep(plan):
+                events[agent.name] = agent.go_sleep(plan)
+        awake = [a for a in agents if a.is_awake()]
+        self._map(lambda a: a.percept(), awake)
+        reacted = self._react(awake)
+        awake = set(a.name for a in awake)
+
+        def _act(agent):
+            if agent.name in awake:
+                if agent.name not in reacted:
+                    agent.follow_plan()
+                agent.reflect()
+            elif agent.action.finished():
+                agent.action = agent._determine_action()
+
+        self._map(_act, agents)
+        return {
+            a.name: {
+                "plan": a.finish_think(events[a.name], self.agents),
+                "info": self._think_info(a),
+            }
+            for a in agents
+        }
+
+    def _react(self, agents):
+        """Decide the reactions of agents concurrently, then commit them.
+
+        The chats are paired in agent order, so an agent takes part in at most
+        one chat, and the pairs run concurrently as they share no agent. The
+        waits read the action of their target, so they run after the chats in
+        agent order. Returns the names of the agents that started a chat.
+        """
+
+        chats, waits, busy = [], [], set()
+        for agent, reaction in zip(
+            agents, self._map(lambda a: a.decide_reaction(self.agents), agents)
+        ):
+            if not reaction:
+                continue
+            mode, other, _ = reaction
+            if mode == "wait":
+                waits.append((agent, other))
+            elif agent.name not in busy and other.name not in busy:
+                # the later decisions with an agent already chatting are dropped
+                busy.update([agent.name, other.name])
+                chats.append((agent, other))
+        records = self._map(lambda c: c[0].react("chat", c[1]), chats)
+        for (agent, _), record in zip(chats, records):
+            agent.record_chat(*record)
+        for agent, other in waits:
+            if agent.name not in busy:
+                agent.react("wait", other)
+        return set(a.name for a, _ in chats)
+
+    def _map(self, func, items):
+        if self.think_workers <= 1 or len(items) <= 1:
+            return [func(i) for i in items]
+        if not self._executor:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.think_workers, thread_name_prefix="agent_think"
+            )
+        return list(self._executor.map(func, items))
+
+    def _think_info(self, agent):
         info = {
             "currently": agent.scratch.currently,
             "associate": agent.associate.abstract(),
@@ -64,10 +162,10 @@ class Game:
         if agent.llm_available():
             info["llm"] = agent._llm.get_summary()
         title = "{}.summary @ {}".format(
-            name, utils.get_timer().get_date("%Y%m%d-%H:%M:%S")
+            agent.name, utils.get_timer().get_date("%Y%m%d-%H:%M:%S")
         )
         self.logger.info("\n{}\n{}\n".format(utils.split_line(title), agent))
-        return {"plan": plan, "info": info}
+        return info
 
     def load_static(self, path):
         return utils.load_dict(os.path.join(self.static_root, path))
@@ -78,6 +176,13 @@ class Game:
             title = "{}.reset".format(a_name)
             self.logger.info("\n{}\n{}\n".format(utils.split_line(title), agent))
 
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+        # block until every queued checkpoint is on disk
+        self.writer.drain()
+
 
 def create_game(name, static_root, config, conversation, logger=None):
     """Create the game"""
@@ -1,13 +1,37 @@
 """generative_agents.maze"""
 
+import math
+import types
+import heapq
 import random
-from itertools import product
+import itertools
+import threading
+import collections
+
+import numpy as np
 
 from modules import utils
 from modules.memory.event import Event
 
 
+# shared by the tiles without events, replaced on the first add_event()
+_NO_EVENTS = types.MappingProxyType({})
+# interned address tuples, tiles of one place share a single tuple
+_ADDRESSES = {}
+
+
 class Tile:
+    __slots__ = (
+        "coord",
+        "address",
+        "address_keys",
+        "collision",
+        "event_cnt",
+        "_events",
+        "_tags",
+        "_subjects",
+    )
+
     def __init__(
         self,
         coord,
@@ -18,16 +42,15 @@ class Tile:
     ):
         # in order: world, sector, arena, game_object
         self.coord = coord
-        self.address = [world]
-        if address:
-            self.address += address
+        address = (world,) + tuple(address or ())
+        self.address = _ADDRESSES.setdefault(address, address)
         self.address_keys = address_keys
-        self.address_map = dict(zip(address_keys[: len(self.address)], self.address))
         self.collision = collision
         self.event_cnt = 0
-        self._events = {}
+        # events by tag, with the tag of every event and the tags of every subject
+        self._events = self._tags = self._subjects = _NO_EVENTS
         if len(self.address) == 4:
-            self.add_event(Event(self.address[-1], address=self.address))
+            self.add_event(Event(self.address[-1], address=list(self.address)))
 
     def abstract(self):
         address = ":".join(self.address)
@@ -52,32 +75,60 @@ class Tile:
     def add_event(self, event):
         if isinstance(event, (tuple, list)):
             event = Event.from_list(event)
-        if all(e != event for e in self._events.values()):
-            self._events["e_" + str(self.event_cnt)] = event
+        if event not in self._tags:
+            tag = "e_" + str(self.event_cnt)
+            self._set_event(tag, event)
             self.event_cnt += 1
         return event
 
     def remove_events(self, subject=None, event=None):
+        tags = list(self._subjects.get(subject, [])) if subject else []
+        if event and event in self._tags:
+            tags.append(self._tags[event])
         r_events = {}
-        for tag, eve in self._events.items():
-            if subject and eve.subject == subject:
-                r_events[tag] = eve
-            if event and eve == event:
-                r_events[tag] = eve
-        for r_eve in r_events:
-            self._events.pop(r_eve)
+        for tag in tags:
+            if tag not in r_events:
+                r_events[tag] = self._unindex(tag)
+                del self._events[tag]
         return r_events
 
     def update_events(self, event, match="subject"):
         u_events = {}
-        for tag, eve in self._events.items():
-            if match == "subject" and eve.subject == event.subject:
-                self._events[tag] = event
+        if match == "subject":
+            tags = list(self._subjects.get(event.subject, []))
+            for tag in tags:
+                self._unindex(tag)
                 u_events[tag] = event
+            for tag in tags:
+                if event in self._tags:
+                    # the event is held by another tag already, drop the copy
+                    self._events.pop(tag)
+                else:
+                    self._set_event(tag, event)
         return u_events
 
+    def _set_event(self, tag, event):
+        if self._events is _NO_EVENTS:
+            self._events, self._tags, self._subjects = {}, {}, {}
+        # a tag keeps its position when its event is replaced
+        self._events[tag] = event
+        self._tags[event] = tag
+        self._subjects.setdefault(event.subject, {})[tag] = None
+
+    def _unindex(self, tag):
+        event = self._events[tag]
+        if self._tags.get(event) == tag:
+            del self._tags[event]
+        tags = self._subjects[event.subject]
+        tags.pop(tag)
+        if not tags:
+            del self._subjects[event.subject]
+        return event
+
     def has_address(self, key):
-        return key in self.address_map
+        if key not in self.address_keys:
+            return False
+        return self.address_keys.index(key) < len(self.address)
 
     def get_address(self, level=None, as_list=True):
         level = level or self.address_keys[-1]
@@ -86,7 +137,7 @@ class Tile:
         )
         pos = self.address_keys.index(level) + 1
         if as_list:
-            return self.address[:pos]
+            return list(self.address[:pos])
         return ":".join(self.address[:pos])
 
     def get_addresses(self):
@@ -97,6 +148,10 @@ class Tile:
             ]
         return addresses
 
+    @property
+    def address_map(self):
+        return dict(zip(self.address_keys, self.address))
+
     @property
     def events(self):
         return self._events
@@ -106,63 +161,507 @@ class Tile:
         return len(self.address) == 1 and not self._events
 
 
+def bfs_field(passable, sources):
+    """Get the breadth first distances from the sources over a passable mask.
+
+    Parameters
+    ----------
+    passable: np.ndarray
+        The (height, width) bool mask of the tiles a path can step on.
+    sources: iterable
+        The (x, y) coords to start from, the ones off the mask are ignored.
+
+    Returns
+    -------
+    field: np.ndarray
+        The steps from the nearest source, -1 for the unreachable tiles.
+    """
+
+    dtype = np.int16 if passable.size < np.iinfo(np.int16).max else np.int32
+    field = np.full(passable.shape, -1, dtype=dtype)
+    frontier = np.zeros(passable.shape, dtype=bool)
+    for x, y in sources:
+        if 0 <= x < passable.shape[1] and 0 <= y < passable.shape[0]:
+            frontier[y, x] = True
+    frontier &= passable
+    distance = 0
+    # one ring per iteration
+    while frontier.any():
+        field[frontier] = distance
+        distance += 1
+        grown = np.zeros_like(frontier)
+        grown[1:, :] |= frontier[:-1, :]
+        grown[:-1, :] |= frontier[1:, :]
+        grown[:, 1:] |= frontier[:, :-1]
+        grown[:, :-1] |= frontier[:, 1:]
+        frontier = grown & passable & (field < 0)
+    return field
+
+
+def walk_field(field, coord):
+    """Walk down a distance field from coord, return the coords to distance 0"""
+
+    path = [coord]
+    distance = field[coord[1], coord[0]]
+    height, width = field.shape
+    while distance > 0:
+        x, y = path[-1]
+        for c in [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]:
+            if 0 <= c[0] < width and 0 <= c[1] < height and field[c[1], c[0]] == distance - 1:
+                path.append(c)
+                break
+        distance -= 1
+    return path
+
+
+class RegionGraph:
+    """Abstract graph of the maze for hierarchical path finding.
+
+    The passable tiles are split into regions, the connected areas sharing one
+    sector and arena. Every straight border segment between two regions gets
+    a pair of portal tiles at its middle, long segments are split first. A path
+    is planned by A* over the portals, with in-region distances read from
+    per-portal distance fields restricted to the bounding box of the region,
+    then refined leg by leg by walking those fields. Paths are shortest up to
+    the detours through the portals.
+    """
+
+    # long border segments are split so portals are at most this far apart
+    portal_span = 8
+
+    def __init__(self, maze):
+        self._passable = maze._passable
+        self._labels, self._boxes = self._label(maze)
+        self._portals, self._links = {}, {}
+        self._find_portals()
+        self._fields, self._portal_edges = {}, {}
+        self._lock = threading.Lock()
+
+    def find_path(self, src, targets):
+        """Plan a path from src to the nearest of targets, [] if there is none"""
+
+        starts = [(src, 0)]
+        if self.region(src) < 0:
+            starts = [(c, 1) for c in self._around(src) if self.region(c) >= 0]
+        regions = {}
+        for t in targets:
+            if self.region(t) >= 0:
+                regions.setdefault(self.region(t), []).append(t)
+        if not starts or not regions:
+            return []
+        goals = {r: self._region_field(r, ts) for r, ts in regions.items()}
+        goal = object()
+        costs, parents, heap, counter = {}, {}, [], itertools.count()
+        xs, ys = [t[0] for t in targets], [t[1] for t in targets]
+        x0, x1, y0, y1 = min(xs), max(xs), min(ys), max(ys)
+
+        def _relax(node, cost, parent):
+            if cost < costs.get(node, float("inf")):
+                costs[node], parents[node] = cost, parent
+                # A* with the manhattan distance to the bounding box of targets
+                if node is goal:
+                    estimate = cost
+                else:
+                    x, y = node
+                    estimate = cost + max(x0 - x, 0, x - x1) + max(y0 - y, 0, y - y1)
+                heapq.heappush(heap, (estimate, next(counter), node))
+
+        for s, cost in starts:
+            _relax(s, cost, None)
+        closed = set()
+        while heap:
+            _, _, node = heapq.heappop(heap)
+            if node is goal:
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+            cost, region = costs[node], self.region(node)
+            if region in goals:
+                distance = self._distance(goals[region], region, node)
+                if distance >= 0:
+                    _relax(goal, cost + distance, node)
+            for portal, distance in self._edges(node):
+                _relax(portal, cost + distance, node)
+            for linked in self._links.get(node, []):
+                _relax(linked, cost + 1, node)
+        if goal not in costs:
+            return []
+
+        # refine the legs between the abstract nodes
+        nodes = [parents[goal]]
+        while parents[nodes[-1]] is not None:
+            nodes.append(parents[nodes[-1]])
+        nodes = nodes[::-1]
+        path = [src] if nodes[0] != src else []
+        for node, next_node in zip(nodes, nodes[1:]):
+            if self.region(node) != self.region(next_node):
+                path.append(node)
+            else:
+                path.extend(self._walk(self._portal_field(next_node), node)[:-1])
+        region = self.region(nodes[-1])
+        path.extend(self._walk(goals[region], nodes[-1]))
+        return path
+
+    def region(self, coord):
+        return self._labels[coord[1], coord[0]]
+
+    def _distance(self, field, region, coord):
+        y0, _, x0, _ = self._boxes[region]
+        return field[coord[1] - y0, coord[0] - x0]
+
+    def _walk(self, field, coord):
+        y0, _, x0, _ = self._boxes[self.region(coord)]
+        path = walk_field(field, (coord[0] - x0, coord[1] - y0))
+        return [(x + x0, y + y0) for x, y in path]
+
+    def _region_field(self, region, sources):
+        y0, y1, x0, x1 = self._boxes[region]
+        mask = self._labels[y0:y1, x0:x1] == region
+        return bfs_field(mask, [(x - x0, y - y0) for x, y in sources])
+
+    def _edges(self, coord):
+        # the portals reachable in the region of coord, with their distances
+        edges = self._portal_edges.get(coord)
+        if edges is None:
+            region = self.region(coord)
+            edges = []
+            for portal in self._portals[region]:
+                distance = self._distance(self._portal_field(portal), region, coord)
+                if portal != coord and distance >= 0:
+                    edges.append((portal, int(distance)))
+            if coord in self._links:
+                self._portal_edges[coord] = edges
+        return edges
+
+    def _portal_field(self, portal):
+        with self._lock:
+            field = self._fields.get(portal)
+        if field is None:
+            field = self._region_field(self.region(portal), [portal])
+            with self._lock:
+                self._fields[portal] = field
+        return field
+
+    def _around(self, coord):
+        x, y = coord
+        height, width = self._passable.shape
+        return [
+            c for c in [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]
+            if 0 <= c[0] < width and 0 <= c[1] < height
+        ]
+
+    def _label(self, maze):
+        areas = maze.address_ids["sector"].astype(np.int64) << 32
+        if "arena" in maze.address_ids:
+            areas |= maze.address_ids["arena"]
+        labels = np.full(self._passable.shape, -1, dtype=np.int32)
+        boxes = []
+        for y, x in zip(*np.nonzero(self._passable)):
+            if labels[y, x] >= 0:
+                continue
+            region, area = len(boxes), areas[y, x]
+            labels[y, x], stack, box = region, [(x, y)], [y, y + 1, x, x + 1]
+            while stack:
+                cx, cy = stack.pop()
+                box = [min(box[0], cy), max(box[1], cy + 1), min(box[2], cx), max(box[3], cx + 1)]
+                for nx, ny in self._around((cx, cy)):
+                    if (
+                        self._passable[ny, nx]
+                        and labels[ny, nx] < 0
+                        and areas[ny, nx] == area
+                    ):
+                        labels[ny, nx] = region
+                        stack.append((nx, ny))
+            boxes.append(tuple(box))
+        return labels, boxes
+
+    def _find_portals(self):
+        # border edges between regions, grouped into straight segments
+        segments = {}
+        for (dx, dy) in [(1, 0), (0, 1)]:
+            a = self._labels[: self._labels.shape[0] - dy, : self._labels.shape[1] - dx]
+            b = self._labels[dy:, dx:]
+            for y, x in zip(*np.nonzero((a >= 0) & (b >= 0) & (a != b))):
+                edge = ((int(x), int(y)), (int(x) + dx, int(y) + dy))
+                key = (dx, a[y, x], b[y, x])
+                segments.setdefault(key, []).append(edge)
+        self._portals = {r: [] for r in range(len(self._boxes))}
+        for (dx, _, _), edges in segments.items():
+            # along a vertical border the edges run in y, otherwise in x
+            axis = 1 if dx else 0
+            edges.sort(key=lambda e: (e[0][1 - axis], e[0][axis]))
+            run = [edges[0]]
+            for edge in edges[1:] + [None]:
+                if (
+                    edge
+                    and len(run) < self.portal_span
+                    and edge[0][1 - axis] == run[-1][0][1 - axis]
+                    and edge[0][axis] == run[-1][0][axis] + 1
+                ):
+                    run.append(edge)
+                    continue
+                a, b = run[len(run) // 2]
+                for p, q in [(a, b), (b, a)]:
+                    if q not in self._links.setdefault(p, []):
+                        self._links[p].append(q)
+                    if p not in self._portals[self.region(p)]:
+                        self._portals[self.region(p)].append(p)
+                run = [edge]
+
+
 class Maze:
+    # memory cap of the cached distance fields
+    field_cache_bytes = 64 * 1024 * 1024
+    # maps with at least this many tiles plan uncached paths hierarchically
+    hierarchical_min_tiles = 256 * 256
+
     def __init__(self, config, logger):
         # define tiles
         self.maze_height, self.maze_width = config["size"]
         self.tile_size = config["tile_size"]
         address_keys = config["tile_address_keys"]
+        tiles = {tuple(t["coord"]): t for t in config["tiles"]}
         self.tiles = [
             [
-                Tile((x, y), config["world"], address_keys)
+                Tile(
+                    (x, y),
+                    config["world"],
+                    address_keys,
+                    **{k: v for k, v in tiles.get((x, y), {}).items() if k != "coord"},
+                )
                 for x in range(self.maze_width)
             ]
             for y in range(self.maze_height)
         ]
-        for tile in config["tiles"]:
-            x, y = tile.pop("coord")
-            self.tiles[y][x] = Tile((x, y), config["world"], address_keys, **tile)
 
         # define address
         self.address_tiles = dict()
-        for i in range(self.maze_height):
-            for j in range(self.maze_width):
-                for add in self.tile_at([j, i]).get_addresses():
-                    self.address_tiles.setdefault(add, set()).add((j, i))
+        for row in self.tiles:
+            for tile in row:
+                for add in tile.get_addresses():
+                    self.address_tiles.setdefault(add, set()).add(tile.coord)
+
+        # grids parallel to the tiles: a collision bitmap and, for every address
+        # level below world, the id of the tile address (0 for none)
+        shape = (self.maze_height, self.maze_width)
+        self.collision = np.zeros(shape, dtype=np.uint8)
+        self.address_ids = {k: np.zeros(shape, dtype=np.int32) for k in address_keys[1:]}
+        self._address_lists = {k: [None] for k in address_keys[1:]}
+        self._address_codes = {}
+        for row in self.tiles:
+            for tile in row:
+                self._index_tile(tile)
+        self._passable = np.zeros(shape, dtype=bool)
+        self._update_passable()
+
+        # tiles holding events, bucketed by the address of their arena
+        self._event_tiles = {}
+        for row in self.tiles:
+            for tile in row:
+                self._index_events(tile)
+        self._fields, self._fields_bytes = collections.OrderedDict(), 0
+        self._fields_lock = threading.Lock()
+        self._region_graph = None
 
         self.logger = logger
 
     def find_path(self, src_coord, dst_coord):
-        map = [[0 for _ in range(self.maze_width)] for _ in range(self.maze_height)]
-        frontier, visited = [src_coord], set()
-        map[src_coord[1]][src_coord[0]] = 1
-        while map[dst_coord[1]][dst_coord[0]] == 0 and frontier:
-            new_frontier = []
-            for f in frontier:
-                for c in self.get_around(f):
-                    if (
-                        0 < c[0] < self.maze_width - 1
-                        and 0 < c[1] < self.maze_height - 1
-                        and map[c[1]][c[0]] == 0
-                        and c not in visited
-                    ):
-                        map[c[1]][c[0]] = map[f[1]][f[0]] + 1
-                        new_frontier.append(c)
-                        visited.add(c)
-            frontier = new_frontier
-        step = map[dst_coord[1]][dst_coord[0]]
-        path = [dst_coord]
-        while step > 1:
-            for c in self.get_around(path[-1]):
-                if map[c[1]][c[0]] == step - 1:
-                    path.append(c)
-                    break
-            step -= 1
+        return self.find_nearest_path(src_coord, [dst_coord])
+
+    def find_nearest_path(self, src_coord, dst_coords, cache=True, exclude=None):
+        """Find the shortest path from src_coord to the nearest of dst_coords.
+
+        With cache, the path is a walk down the cached distance field of the
+        targets, see distance_field(). Otherwise one breadth first search
+        expands from the source and stops at the first target it reaches, which
+        suits one-off targets such as the tiles around another agent.
+
+        The field is keyed by all of dst_coords, so it is reused while the
+        excluded tiles change. When the walk ends at an excluded tile, the
+        nearest free target is searched for instead.
+
+        Parameters
+        ----------
+        src_coord: list or tuple
+            The start coord.
+        dst_coords: list
+            The candidate target coords.
+        cache: bool
+            Whether to use and keep the distance field of dst_coords.
+        exclude: iterable
+            The coords of dst_coords not to end at, such as occupied tiles.
+
+        Returns
+        -------
+        path: list
+            The coords from src_coord to the reached target, both included. When
+            no target is reachable, [the first free target] as find_path always
+            did, [] when all the targets are excluded.
+        """
+
+        src = tuple(src_coord)
+        targets = [tuple(c) for c in dst_coords]
+        exclude = {tuple(c) for c in exclude or []}
+        free = {c for c in targets if c not in exclude}
+        if not free:
+            return []
+        if src in free:
+            return [src]
+        # a full map flood per new destination is too slow on large maps
+        hierarchical = self._passable.size >= self.hierarchical_min_tiles
+        path = None
+        if cache and not (hierarchical and not self.has_field(targets)):
+            path = self._walk_field(src, self.distance_field(targets))
+            if path and path[-1] in exclude:
+                path = None
+        if path is None:
+            if cache and hierarchical:
+                path = self.region_graph.find_path(src, free)
+            else:
+                path = self._search_path(src, free)
+        return path or [next(c for c in targets if c in free)]
+
+    def distance_field(self, dst_coords):
+        """Get the distance field of the target coords.
+
+        The field holds the steps from every tile to the nearest target, -1 for
+        the tiles that can not reach any. Fields are built lazily and kept in an
+        LRU cache bounded by `field_cache_bytes`, so the frequent destinations
+        (beds, counters, classrooms) are computed once for all agents.
+
+        Parameters
+        ----------
+        dst_coords: iterable
+            The target coords.
+
+        Returns
+        -------
+        field: np.ndarray
+            The (maze_height, maze_width) distances, read only.
+        """
+
+        key = frozenset(tuple(c) for c in dst_coords)
+        with self._fields_lock:
+            if key in self._fields:
+                self._fields.move_to_end(key)
+                return self._fields[key]
+        field = bfs_field(self._passable, key)
+        field.flags.writeable = False
+        with self._fields_lock:
+            if key not in self._fields:
+                self._fields[key] = field
+                self._fields_bytes += field.nbytes
+            while self._fields_bytes > self.field_cache_bytes and len(self._fields) > 1:
+                _, evicted = self._fields.popitem(last=False)
+                self._fields_bytes -= evicted.nbytes
+        return field
+
+    def has_field(self, dst_coords):
+        with self._fields_lock:
+            return frozenset(tuple(c) for c in dst_coords) in self._fields
+
+    @property
+    def region_graph(self):
+        """The RegionGraph for hierarchical path finding, built on first use"""
+
+        if self._region_graph is None:
+            self._region_graph = RegionGraph(self)
+        return self._region_graph
+
+    def _walk_field(self, src, field):
+        start = [
+            c for c in self.get_around(src, no_collision=False)
+            if self._passable[c[1], c[0]] and field[c[1], c[0]] >= 0
+        ]
+        if not start:
+            return []
+        return [src] + walk_field(field, min(start, key=lambda c: field[c[1], c[0]]))
+
+    def _search_path(self, src, targets):
+        parents, frontier = {src: None}, collections.deque([src])
+        reached = None
+        while frontier and reached is None:
+            f = frontier.popleft()
+            for c in self.get_around(f, no_collision=False):
+                if self._passable[c[1], c[0]] and c not in parents:
+                    parents[c] = f
+                    if c in targets:
+                        reached = c
+                        break
+                    frontier.append(c)
+        if reached is None:
+            return []
+        path = [reached]
+        while parents[path[-1]] is not None:
+            path.append(parents[path[-1]])
         return path[::-1]
 
     def tile_at(self, coord):
         return self.tiles[coord[1]][coord[0]]
 
+    def set_collision(self, coord, collision=True):
+        """Change the collision of a tile, keeping the grids in sync"""
+
+        self.tile_at(coord).collision = collision
+        self.collision[coord[1], coord[0]] = collision
+        self._update_passable()
+        with self._fields_lock:
+            self._fields.clear()
+            self._fields_bytes = 0
+        self._region_graph = None
+
+    def get_address_id(self, address):
+        """Get the grid id of an address list, 0 if it is unknown"""
+
+        return self._address_codes.get(":".join(address), 0)
+
+    def get_address_name(self, level, address_id):
+        address = self._address_lists[level][address_id]
+        return ":".join(address) if address else None
+
+    def _index_tile(self, tile):
+        x, y = tile.coord
+        self.collision[y, x] = tile.collision
+        for i, (level, address) in enumerate(
+            zip(tile.address_keys[1:], tile.get_addresses())
+        ):
+            code = self._address_codes.get(address)
+            if code is None:
+                code = len(self._address_lists[level])
+                self._address_lists[level].append(tile.address[: i + 2])
+                self._address_codes[address] = code
+            self.address_ids[level][y, x] = code
+
+    def _index_events(self, tile):
+        key = tile.get_address("arena", as_list=False)
+        if tile.events:
+            self._event_tiles.setdefault(key, set()).add(tile.coord)
+        elif tile.coord in self._event_tiles.get(key, ()):
+            self._event_tiles[key].discard(tile.coord)
+
+    def add_event(self, coord, event):
+        """Add an event to the tile at coord, keeping the event index in sync"""
+
+        tile = self.tile_at(coord)
+        event = tile.add_event(event)
+        self._index_events(tile)
+        return event
+
+    def remove_events(self, coord, subject=None, event=None):
+        tile = self.tile_at(coord)
+        r_events = tile.remove_events(subject=subject, event=event)
+        self._index_events(tile)
+        return r_events
+
+    def update_events(self, coord, event, match="subject"):
+        return self.tile_at(coord).update_events(event, match=match)
+
+    def _update_passable(self):
+        # tiles a path can step on: no collision and off the border
+        self._passable[:] = False
+        self._passable[1:-1, 1:-1] = self.collision[1:-1, 1:-1] == 0
+
     def update_obj(self, coord, obj_event):
         tile = self.tile_at(coord)
         if not tile.has_address("game_object"):
@@ -176,19 +675,72 @@ class Maze:
             self.tile_at(c).update_events(obj_event)
 
     def get_scope(self, coord, config):
-        coords = []
+        box = self._scope_box(coord, config)
+        if not box:
+            return []
+        x0, x1, y0, y1 = box
+        return [row[x] for x in range(x0, x1) for row in self.tiles[y0:y1]]
+
+    def get_scope_objects(self, coord, config):
+        """Get the game_object addresses in scope, in the order of get_scope()"""
+
+        box = self._scope_box(coord, config)
+        if not box:
+            return []
+        x0, x1, y0, y1 = box
+        ids = self.address_ids["game_object"][y0:y1, x0:x1].T.ravel()
+        ids, first = np.unique(ids, return_index=True)
+        addresses = self._address_lists["game_object"]
+        return [addresses[i] for i in ids[np.argsort(first)] if i]
+
+    def get_scope_events(self, coord, config, arena):
+        """Get the events in scope and in arena.
+
+        Only the tiles holding events in the arena are visited, so the cost
+        follows the number of nearby events instead of the vision area.
+
+        Parameters
+        ----------
+        coord: list or tuple
+            The center of the scope.
+        config: dict
+            The percept config, with mode and vision_r.
+        arena: list
+            The arena address, as Tile.get_address("arena").
+
+        Returns
+        -------
+        events: dict
+            The events as {event: distance to the closest tile holding it}.
+        """
+
+        events = {}
+        box = self._scope_box(coord, config)
+        if not box:
+            return events
+        x0, x1, y0, y1 = box
+        coords = [
+            c for c in self._event_tiles.get(":".join(arena), ())
+            if x0 <= c[0] < x1 and y0 <= c[1] < y1
+        ]
+        # visit in the order of get_scope(), so ties keep their order
+        for c in sorted(coords):
+            dist = math.dist(c, coord)
+            for event in self.tile_at(c).get_events():
+                if dist < events.get(event, float("inf")):
+                    events[event] = dist
+        return events
+
+    def _scope_box(self, coord, config):
+        if config["mode"] != "box":
+            return None
         vision_r = config["vision_r"]
-        if config["mode"] == "box":
-            x_range = [
-                max(coord[0] - vision_r, 0),
-                min(coord[0] + vision_r + 1, self.maze_width),
-            ]
-            y_range = [
-                max(coord[1] - vision_r, 0),
-                min(coord[1] + vision_r + 1, self.maze_height),
-            ]
-            coords = list(product(list(range(*x_range)), list(range(*y_range))))
-        return [self.tile_at(c) for c in coords]
+        return (
+            max(coord[0] - vision_r, 0),
+            min(coord[0] + vision_r + 1, self.maze_width),
+            max(coord[1] - vision_r, 0),
+            min(coord[1] + vision_r + 1, self.maze_height),
+        )
 
     def get_around(self, coord, no_collision=True):
         coords = [
@@ -198,7 +750,7 @@ class Maze:
             (coord[0], coord[1] + 1),
         ]
         if no_collision:
-            coords = [c for c in coords if not self.tile_at(c).collision]
+            coords = [c for c in coords if not self.collision[c[1], c[0]]]
         return coords
 
     def get_address_tiles(self, address):
@@ -1,16 +1,26 @@
 """generative_agents.memory.associate"""
 
 import datetime
-from llama_index.core.retrievers import BaseRetriever
-from llama_index.core.vector_stores import MetadataFilters, ExactMatchFilter
-from llama_index.core.indices.vector_store.retrievers import VectorIndexRetriever
+import collections
 
-from modules.storage.index import LlamaIndex
+import numpy as np
+
+from modules.storage.vector_store import VectorStore
 from modules import utils
 from .event import Event
 
 
 class Concept:
+    __slots__ = (
+        "node_id",
+        "node_type",
+        "event",
+        "poignancy",
+        "create",
+        "expire",
+        "access",
+    )
+
     def __init__(
         self,
         describe,
@@ -73,53 +83,6 @@ class Concept:
         )
 
 
-class AssociateRetriever(BaseRetriever):
-    def __init__(self, config, *args, **kwargs) -> None:
-        self._config = config
-        self._vector_retriever = VectorIndexRetriever(*args, **kwargs)
-        super().__init__()
-
-    def _retrieve(self, query_bundle):
-        """Retrieve nodes given query."""
-
-        nodes = self._vector_retriever.retrieve(query_bundle)
-        if not nodes:
-            return []
-        nodes = sorted(
-            nodes, key=lambda n: utils.to_date(n.metadata["access"]), reverse=True
-        )
-        # get scores
-        fac = self._config["recency_decay"]
-        recency_scores = self._normalize(
-            [fac**i for i in range(1, len(nodes) + 1)], self._config["recency_weight"]
-        )
-        relevance_scores = self._normalize(
-            [n.score for n in nodes], self._config["relevance_weight"]
-        )
-        importance_scores = self._normalize(
-            [n.metadata["poignancy"] for n in nodes], self._config["importance_weight"]
-        )
-        final_scores = {
-            n.id_: r1 + r2 + i
-            for n, r1, r2, i in zip(
-                nodes, recency_scores, relevance_scores, importance_scores
-            )
-        }
-        # re-rank nodes
-        nodes = sorted(nodes, key=lambda n: final_scores[n.id_], reverse=True)
-        nodes = nodes[: self._config["retrieve_max"]]
-        for n in nodes:
-            n.metadata["access"] = utils.get_timer().get_date("%Y%m%d-%H:%M:%S")
-        return nodes
-
-    def _normalize(self, data, factor=1, t_min=0, t_max=1):
-        min_val, max_val = min(data), max(data)
-        diff = max_val - min_val
-        if diff == 0:
-            return [(t_max - t_min) * factor / 2 for _ in data]
-        return [(d - min_val) * (t_max - t_min) * factor / diff + t_min for d in data]
-
-
 class Associate:
     def __init__(
         self,
@@ -133,11 +96,11 @@ class Associate:
         relevance_weight=3,
         importance_weight=2,
         memory=None,
+        concept_cache=4096,
     ):
         self._index_config = {"embedding": embedding, "path": path}
-        self._index = LlamaIndex(**self._index_config)
+        self._index = VectorStore(**self._index_config)
         self.memory = memory or {"event": [], "thought": [], "chat": []}
-        self.cleanup_index()
         self.retention = retention
         self.max_memory = max_memory
         self.max_importance = max_importance
@@ -147,6 +110,14 @@ class Associate:
             "relevance_weight": relevance_weight,
             "importance_weight": importance_weight,
         }
+        # concepts by node_id, LRU bounded by concept_cache, dropped when the
+        # node is removed or accessed
+        self._concepts, self._concept_cache = collections.OrderedDict(), concept_cache
+        # the latest `retention` memories of every type as (node_id, describe),
+        # with the count of every describe among them
+        self._recent, self._recent_describes = {}, {}
+        self._reset_recent()
+        self.cleanup_index()
 
     def abstract(self):
         des = {"nodes": self._index.nodes_num}
@@ -158,11 +129,39 @@ class Associate:
         return utils.dump_dict(self.abstract())
 
     def cleanup_index(self):
-        node_ids = self._index.cleanup()
-        self.memory = {
-            n_type: [n for n in nodes if n not in node_ids]
-            for n_type, nodes in self.memory.items()
-        }
+        node_ids = set(self._index.cleanup())
+        if node_ids:
+            self._forget(node_ids)
+            self.memory = {
+                n_type: [n for n in nodes if n not in node_ids]
+                for n_type, nodes in self.memory.items()
+            }
+            self._reset_recent()
+
+    def is_recent(self, describe, node_types=("event", "chat")):
+        """Whether describe is among the latest `retention` memories of node_types"""
+
+        return any(self._recent_describes[t][describe] > 0 for t in node_types)
+
+    def _reset_recent(self, node_types=None):
+        for n_type in node_types or self.memory:
+            recent = collections.deque(
+                (n, self.find_concept(n).describe)
+                for n in self.memory[n_type][: self.retention]
+                if self._index.has_node(n)
+            )
+            self._recent[n_type] = recent
+            self._recent_describes[n_type] = collections.Counter(d for _, d in recent)
+
+    def _push_recent(self, node_type, node_id, describe):
+        recent, describes = self._recent[node_type], self._recent_describes[node_type]
+        recent.appendleft((node_id, describe))
+        describes[describe] += 1
+        while len(recent) > self.retention:
+            _, describe = recent.pop()
+            describes[describe] -= 1
+            if describes[describe] <= 0:
+                del describes[describe]
 
     def add_node(
         self,
@@ -187,26 +186,46 @@ class Associate:
             "access": create.strftime("%Y%m%d-%H:%M:%S"),
         }
         node = self._index.add_node(event.get_describe(), metadata)
+        if node is None:
+            # the embedding backend is down, perceive the event without
+            # remembering it
+            return Concept.from_event(
+                "unindexed_" + event.get_describe(), node_type, event, poignancy
+            )
+        concept = self.to_concept(node)
         memory = self.memory[node_type]
         memory.insert(0, node.id_)
         if len(memory) >= self.max_memory > 0:
             self._index.remove_nodes(memory[self.max_memory:])
+            self._forget(memory[self.max_memory:])
             self.memory[node_type] = memory[: self.max_memory - 1]
-        return self.to_concept(node)
+            self._reset_recent([node_type])
+        else:
+            self._push_recent(node_type, node.id_, concept.describe)
+        return concept
 
     def to_concept(self, node):
-        return Concept.from_node(node)
+        concept = self._concepts.get(node.id_)
+        if concept is None:
+            concept = Concept.from_node(node)
+            self._concepts[node.id_] = concept
+            if len(self._concepts) > self._concept_cache:
+                self._concepts.popitem(last=False)
+        else:
+            self._concepts.move_to_end(node.id_)
+        return concept
+
+    def _forget(self, node_ids):
+        for node_id in node_ids:
+            self._concepts.pop(node_id, None)
 
     def find_concept(self, node_id):
         return self.to_concept(self._index.find_node(node_id))
 
     def _retrieve_nodes(self, node_type, text=None):
         if text:
-            filters = MetadataFilters(
-                filters=[ExactMatchFilter(key="node_type", value=node_type)]
-            )
             nodes = self._index.retrieve(
-                text, filters=filters, node_ids=self.memory[node_type]
+                text, node_type=node_type, node_ids=self.memory[node_type]
             )
         else:
             nodes = [self._index.find_node(n) for n in self.memory[node_type]]
@@ -223,19 +242,13 @@ class Associate:
         return self._retrieve_nodes("chat", text)
 
     def retrieve_focus(self, focus, retrieve_max=30, reduce_all=True):
-        def _create_retriever(*args, **kwargs):
-            self._retrieve_config["retrieve_max"] = retrieve_max
-            return AssociateRetriever(self._retrieve_config, *args, **kwargs)
-
         retrieved = {}
         node_ids = self.memory["event"] + self.memory["thought"]
-        for text in focus:
-            nodes = self._index.retrieve(
-                text,
-                similarity_top_k=len(node_ids),
-                node_ids=node_ids,
-                retriever_creator=_create_retriever,
-            )
+        # one embedding request and one similarity pass for all the texts, the
+        # re-rank stays per text since it updates the access times
+        rows, scores = self._index.similarity_batch(focus, node_ids=node_ids)
+        for text, text_scores in zip(focus, scores):
+            nodes = self._rerank(rows, text_scores, retrieve_max)
             if reduce_all:
                 retrieved.update({n.id_: n for n in nodes})
             else:
@@ -247,6 +260,48 @@ class Associate:
             for text, nodes, in retrieved.items()
         }
 
+    def _rerank(self, rows, scores, retrieve_max):
+        """Re-rank the rows of the index by recency, relevance and importance"""
+
+        if not len(rows):
+            return []
+        # order by relevance, then by access time, the ties keep their order
+        order = np.argsort(-scores, kind="stable")
+        access = self._index.column("access", rows[order])
+        order = order[np.argsort(-access, kind="stable")]
+        # get scores
+        fac = self._retrieve_config["recency_decay"]
+        recency_scores = self._normalize(
+            fac ** np.arange(1, len(order) + 1), self._retrieve_config["recency_weight"]
+        )
+        relevance_scores = self._normalize(
+            scores[order].astype(np.float64), self._retrieve_config["relevance_weight"]
+        )
+        importance_scores = self._normalize(
+            self._index.column("poignancy", rows[order]).astype(np.float64),
+            self._retrieve_config["importance_weight"],
+        )
+        final_scores = recency_scores + relevance_scores + importance_scores
+        # re-rank nodes, keeping all the ties at the cut so the sort stays stable
+        candidates = np.arange(len(order))
+        if retrieve_max < len(order):
+            kth = np.partition(-final_scores, retrieve_max - 1)[retrieve_max - 1]
+            candidates = np.flatnonzero(-final_scores <= kth)
+        candidates = candidates[np.argsort(-final_scores[candidates], kind="stable")]
+        top = order[candidates[:retrieve_max]]
+        nodes = self._index.nodes_at(rows[top], scores[top])
+        node_ids = [n.id_ for n in nodes]
+        self._index.update_access(node_ids, utils.get_timer().get_date("%Y%m%d-%H:%M:%S"))
+        self._forget(node_ids)
+        return nodes
+
+    def _normalize(self, data, factor=1, t_min=0, t_max=1):
+        min_val, max_val = data.min(), data.max()
+        diff = max_val - min_val
+        if diff == 0:
+            return np.full(len(data), (t_max - t_min) * factor / 2)
+        return (data - min_val) * (t_max - t_min) * factor / diff + t_min
+
     def get_relation(self, node):
         return {
             "node": node,
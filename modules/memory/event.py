@@ -2,6 +2,16 @@
 
 
 class Event:
+    __slots__ = (
+        "subject",
+        "predicate",
+        "object",
+        "_describe",
+        "address",
+        "emoji",
+        "_hash",
+    )
+
     def __init__(
         self,
         subject,
@@ -19,6 +29,7 @@ class Event:
         self._describe = describe or ""
         self.address = address or []
         self.emoji = emoji or ""
+        self._hash = None
 
     def __str__(self):
         if self._describe:
@@ -32,15 +43,18 @@ class Event:
         return des
 
     def __hash__(self):
-        return hash(
-            (
-                self.subject,
-                self.predicate,
-                self.object,
-                self._describe,
-                ":".join(self.address),
+        # cached, events are compared on every tile update
+        if self._hash is None:
+            self._hash = hash(
+                (
+                    self.subject,
+                    self.predicate,
+                    self.object,
+                    self._describe,
+                    ":".join(self.address),
+                )
             )
-        )
+        return self._hash
 
     def __eq__(self, other):
         if isinstance(other, Event):
@@ -53,6 +67,7 @@ class Event:
         self.predicate = predicate or "此時"
         self.object = object or "空閒"
         self._describe = describe or self._describe
+        self._hash = None
 
     def to_id(self):
         return self.subject, self.predicate, self.object, self._describe
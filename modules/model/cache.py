@@ -0,0 +1,132 @@
+"""generative_agents.model.cache"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class CompletionCache:
+    """Content-addressed completion cache, LRU bounded in memory and on disk"""
+
+    def __init__(self, path=None, max_size=4096, max_disk=100000):
+        self._max_size = max_size
+        self._max_disk = max_disk
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db, self._disk_size = None, 0
+        if path:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completion "
+                "(key TEXT PRIMARY KEY, response TEXT, access REAL)"
+            )
+            self._db.commit()
+            self._disk_size = self._db.execute(
+                "SELECT COUNT(*) FROM completion"
+            ).fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            if not self._db:
+                return None
+            row = self._db.execute(
+                "SELECT response FROM completion WHERE key=?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            self._db.execute(
+                "UPDATE completion SET access=? WHERE key=?", (time.time(), key)
+            )
+            self._db.commit()
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key, response):
+        with self._lock:
+            self._remember(key, response)
+            if not self._db:
+                return
+            exists = self._db.execute(
+                "SELECT 1 FROM completion WHERE key=?", (key,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO completion VALUES (?, ?, ?)",
+                (key, response, time.time()),
+            )
+            if not exists:
+                self._disk_size += 1
+            if self._disk_size > self._max_disk > 0:
+                # evict a batch of the least recently used entries at once
+                evict = self._disk_size - self._max_disk + max(self._max_disk // 10, 1)
+                self._db.execute(
+                    "DELETE FROM completion WHERE key IN "
+                    "(SELECT key FROM completion ORDER BY access LIMIT ?)",
+                    (evict,),
+                )
+                self._disk_size = max(self._disk_size - evict, 0)
+            self._db.commit()
+
+    def remove(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            if not self._db:
+                return
+            deleted = self._db.execute(
+                "DELETE FROM completion WHERE key=?", (key,)
+            ).rowcount
+            self._disk_size -= deleted
+            self._db.commit()
+
+    def _remember(self, key, response):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_size > 0:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def make_key(model, prompt, **options):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return "{}:{}:{}".format(
+            model, json.dumps(options, sort_keys=True, ensure_ascii=False), digest
+        )
+
+    @property
+    def size(self):
+        return len(self._memory), self._disk_size
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_cache(config):
+    """Get the process-wide completion cache for the given config.
+
+    Parameters
+    ----------
+    config: dict
+        The cache config, keys: path, max_size, max_disk.
+
+    Returns
+    -------
+    cache: CompletionCache
+        The shared cache, models with the same cache path share the entries.
+    """
+
+    key = config.get("path") or ""
+    with _CACHES_LOCK:
+        if key not in _CACHES:
+            _CACHES[key] = CompletionCache(**config)
+        return _CACHES[key]
@@ -4,10 +4,14 @@ import os
 import time
 import re
 import json
-import requests
+import asyncio
+import weakref
 
 from modules.utils.namespace import ModelType
 from modules import utils
+from .session import get_session, get_async_session
+from .cache import get_cache
+from .scheduler import get_queue, backend_key, caller_priority, Priority
 
 
 class ModelStyle:
@@ -25,29 +29,47 @@ class LLMModel:
         self._base_url = base_url
         self._model = model
         self._embedding_model = embedding_model
+        config = config or {}
         self._handle = self.setup(keys, config)
+        self._cache = get_cache(config["cache"]) if config.get("cache") else None
+        self._retry = utils.create_retry_policy(
+            "{}:{}".format(self.model_style(), base_url), config.get("retry")
+        )
+        self._queue = get_queue(
+            backend_key(self.model_style(), base_url),
+            {**self.default_schedule(), **config.get("schedule", {})},
+        )
         self._meta_responses = []
         self._summary = {"total": [0, 0, 0]}
+        self._cache_summary = {}
         self._enabled = True
 
     def embedding(self, text, retry=10):
-        response = None
-        for _ in range(retry):
-            try:
-                response = self._embedding(text)
-            except Exception as e:
-                print(f"LLMModel.embedding() caused an error: {e}")
-                time.sleep(5)
-                continue
-            if response:
-                break
-        return response
+        try:
+            return self._retry.run(
+                self._scheduled, Priority.NORMAL, self._embedding, text, retry=retry
+            )
+        except Exception as e:
+            print(f"LLMModel.embedding() caused an error: {e}")
+            return None
+
+    async def aembedding(self, text, retry=10):
+        try:
+            return await self._retry.arun(
+                self._ascheduled, Priority.NORMAL, self._aembedding, text, retry=retry
+            )
+        except Exception as e:
+            print(f"LLMModel.aembedding() caused an error: {e}")
+            return None
 
     def _embedding(self, text):
         raise NotImplementedError(
             "_embedding is not support for " + str(self.__class__)
         )
 
+    async def _aembedding(self, text):
+        return await asyncio.to_thread(self._embedding, text)
+
     def completion(
         self,
         prompt,
@@ -55,38 +77,154 @@ class LLMModel:
         callback=None,
         failsafe=None,
         caller="llm_normal",
+        cache=True,
+        meta_responses=None,
         **kwargs
     ):
-        prompt = prompt + "\n請以繁體中文輸出回答。"
-        response, self._meta_responses = None, []
-        self._summary.setdefault(caller, [0, 0, 0])
-        for _ in range(retry):
+        # the raw responses of this call, appended to meta_responses if given
+        responses = [] if meta_responses is None else meta_responses
+        prompt, cache_key, response = self._prepare_completion(
+            prompt, callback, caller, cache, responses, kwargs
+        )
+        if response is not None:
+            return response
+        priority = caller_priority(caller)
+        start, transport_errors, meta_response = time.monotonic(), 0, None
+        for attempt in range(retry):
+            # fail fast to failsafe while the backend is down
+            if not self._retry.breaker.allow():
+                print(f"LLMModel.completion() skipped, {self._base_url} is unavailable")
+                break
             try:
-                meta_response = self._completion(prompt, **kwargs)
-                self._meta_responses.append(meta_response)
-                self._summary["total"][0] += 1
-                self._summary[caller][0] += 1
-                if callback:
-                    response = callback(meta_response)
-                else:
-                    response = meta_response
+                meta_response = self._scheduled(
+                    priority, self._completion, prompt, **kwargs
+                )
             except Exception as e:
                 print(f"LLMModel.completion() caused an error: {e}")
-                time.sleep(5)
-                response = None
+                self._retry.breaker.failure()
+                if attempt + 1 >= retry or not self._retry.backoff(transport_errors, start):
+                    break
+                transport_errors += 1
                 continue
+            response = self._parse_completion(meta_response, callback, caller, responses)
             if response is not None:
                 break
+        return self._finish_completion(cache_key, meta_response, response, failsafe, caller)
+
+    async def acompletion(
+        self,
+        prompt,
+        retry=10,
+        callback=None,
+        failsafe=None,
+        caller="llm_normal",
+        cache=True,
+        meta_responses=None,
+        **kwargs
+    ):
+        """Async version of completion, see completion for the arguments"""
+
+        # the raw responses of this call, appended to meta_responses if given
+        responses = [] if meta_responses is None else meta_responses
+        prompt, cache_key, response = self._prepare_completion(
+            prompt, callback, caller, cache, responses, kwargs
+        )
+        if response is not None:
+            return response
+        priority = caller_priority(caller)
+        start, transport_errors, meta_response = time.monotonic(), 0, None
+        for attempt in range(retry):
+            if not self._retry.breaker.allow():
+                print(f"LLMModel.acompletion() skipped, {self._base_url} is unavailable")
+                break
+            try:
+                meta_response = await self._ascheduled(
+                    priority, self._acompletion, prompt, **kwargs
+                )
+            except Exception as e:
+                print(f"LLMModel.acompletion() caused an error: {e}")
+                self._retry.breaker.failure()
+                if attempt + 1 >= retry or not await self._retry.abackoff(
+                    transport_errors, start
+                ):
+                    break
+                transport_errors += 1
+                continue
+            response = self._parse_completion(meta_response, callback, caller, responses)
+            if response is not None:
+                break
+        return self._finish_completion(cache_key, meta_response, response, failsafe, caller)
+
+    def _scheduled(self, priority, func, *args, **kwargs):
+        # hold a backend slot only while the request is in flight
+        with self._queue.slot(priority):
+            return func(*args, **kwargs)
+
+    async def _ascheduled(self, priority, func, *args, **kwargs):
+        async with self._queue.aslot(priority):
+            return await func(*args, **kwargs)
+
+    def _prepare_completion(self, prompt, callback, caller, cache, responses, kwargs):
+        prompt = prompt + "\n請以繁體中文輸出回答。"
+        self._meta_responses = responses
+        self._summary.setdefault(caller, [0, 0, 0])
+        if not self._cache or not cache:
+            return prompt, None, None
+        cache_key = self._cache.make_key(self._model, prompt, **kwargs)
+        response = self._cached_completion(cache_key, callback, caller, responses)
+        if response is not None:
+            self._summary["total"][1] += 1
+            self._summary[caller][1] += 1
+        return prompt, cache_key, response
+
+    def _parse_completion(self, meta_response, callback, caller, responses):
+        self._retry.breaker.success()
+        responses.append(meta_response)
+        self._summary["total"][0] += 1
+        self._summary[caller][0] += 1
+        # parse errors are retried at once, the backend itself is fine
+        try:
+            return callback(meta_response) if callback else meta_response
+        except Exception as e:
+            print(f"LLMModel.completion() failed to parse the response: {e}")
+            return None
+
+    def _finish_completion(self, cache_key, meta_response, response, failsafe, caller):
+        if cache_key and response is not None:
+            self._cache.put(cache_key, meta_response)
         pos = 2 if response is None else 1
         self._summary["total"][pos] += 1
         self._summary[caller][pos] += 1
         return response or failsafe
 
+    def _cached_completion(self, cache_key, callback, caller, responses):
+        total = self._cache_summary.setdefault("total", [0, 0])
+        counter = self._cache_summary.setdefault(caller, [0, 0])
+        meta_response, response = self._cache.get(cache_key), None
+        if meta_response is not None:
+            try:
+                response = callback(meta_response) if callback else meta_response
+            except Exception:
+                # the cached response can not be parsed any more, drop it
+                self._cache.remove(cache_key)
+        if response is None:
+            total[1] += 1
+            counter[1] += 1
+            return None
+        responses.append(meta_response)
+        total[0] += 1
+        counter[0] += 1
+        return response
+
     def _completion(self, prompt, **kwargs):
         raise NotImplementedError(
             "_completion is not support for " + str(self.__class__)
         )
 
+    async def _acompletion(self, prompt, **kwargs):
+        # sdk only backends offload the blocking call to a thread
+        return await asyncio.to_thread(self._completion, prompt, **kwargs)
+
     def is_available(self):
         return self._enabled  # and self._summary["total"][2] <= 10
 
@@ -94,6 +232,9 @@ class LLMModel:
         des = {}
         for k, v in self._summary.items():
             des[k] = "S:{},F:{}/R:{}".format(v[1], v[2], v[0])
+            if k in self._cache_summary:
+                hit, miss = self._cache_summary[k]
+                des[k] += ",H:{}/M:{}".format(hit, miss)
         return {"model": self._model, "summary": des}
 
     def disable(self):
@@ -101,12 +242,20 @@ class LLMModel:
 
     @property
     def meta_responses(self):
+        """The raw responses of the latest call, concurrent callers should pass
+        their own meta_responses list to the call instead"""
+
         return self._meta_responses
 
     @classmethod
     def model_type(cls):
         return ModelType.LLM
 
+    @classmethod
+    def default_schedule(cls):
+        # cloud providers are rate limited, requests per second
+        return {"max_concurrency": 8, "rate": 5}
+
 
 @utils.register_model
 class OpenAILLMModel(LLMModel):
@@ -114,7 +263,18 @@ class OpenAILLMModel(LLMModel):
         from openai import OpenAI
 
         self._embedding_model = config.get("embedding_model", "text-embedding-3-small")
-        return OpenAI(api_key=keys["OPENAI_API_KEY"])
+        self._api_key = keys["OPENAI_API_KEY"]
+        self._async_handles = weakref.WeakKeyDictionary()
+        return OpenAI(api_key=self._api_key)
+
+    def _async_handle(self):
+        from openai import AsyncOpenAI
+
+        # the async client is bound to the event loop it is used in
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_handles:
+            self._async_handles[loop] = AsyncOpenAI(api_key=self._api_key)
+        return self._async_handles[loop]
 
     def _embedding(self, text):
         response = self._handle.embeddings.create(
@@ -122,6 +282,12 @@ class OpenAILLMModel(LLMModel):
         )
         return response.data[0].embedding
 
+    async def _aembedding(self, text):
+        response = await self._async_handle().embeddings.create(
+            input=text, model=self._embedding_model
+        )
+        return response.data[0].embedding
+
     def _completion(self, prompt, temperature=0.00001):
         messages = [{"role": "user", "content": prompt}]
         response = self._handle.chat.completions.create(
@@ -131,6 +297,15 @@ class OpenAILLMModel(LLMModel):
             return response.choices[0].message.content
         return ""
 
+    async def _acompletion(self, prompt, temperature=0.00001):
+        messages = [{"role": "user", "content": prompt}]
+        response = await self._async_handle().chat.completions.create(
+            model=self._model, messages=messages, temperature=temperature
+        )
+        if len(response.choices) > 0:
+            return response.choices[0].message.content
+        return ""
+
     @classmethod
     def support_model(cls, model):
         return model in ("gpt-3.5-turbo", "text-embedding-3-small")
@@ -147,23 +322,25 @@ class OpenAILLMModel(LLMModel):
 @utils.register_model
 class OllamaLLMModel(LLMModel):
     def setup(self, keys, config):
-        return None
+        self._http_config = config.get("http")
+        return get_session(self._http_config)
 
-    def ollama_chat(self, messages, temperature, stream):
-        headers = {
-            "Content-Type": "application/json"
-        }
-        params = {
+    def _chat_params(self, messages, temperature, stream):
+        return {
             "model": self._model,
             "messages": messages,
             "temperature": temperature,
             "stream": stream,
         }
 
-        response = requests.post(
+    def ollama_chat(self, messages, temperature, stream):
+        headers = {
+            "Content-Type": "application/json"
+        }
+        response = self._handle.post(
             url=f"{self._base_url}/chat/completions",
             headers=headers,
-            json=params,
+            json=self._chat_params(messages, temperature, stream),
             stream=stream
         )
         return response.json()
@@ -177,7 +354,7 @@ class OllamaLLMModel(LLMModel):
             "input": text,
         }
 
-        response = requests.post(
+        response = self._handle.post(
             url=f"{self._base_url}/embeddings",
             headers=headers,
             json=params,
@@ -188,6 +365,16 @@ class OllamaLLMModel(LLMModel):
         response = self.ollama_embeddings(text)
         return response["data"][0]["embedding"]
 
+    async def _aembedding(self, text):
+        session = get_async_session(self._http_config)
+        if not session:
+            return await super()._aembedding(text)
+        response = await session.post(
+            f"{self._base_url}/embeddings",
+            json={"model": self._embedding_model, "input": text},
+        )
+        return response.json()["data"][0]["embedding"]
+
     def _completion(self, prompt, temperature=0.00001):
         messages = [{"role": "user", "content": prompt}]
         response = self.ollama_chat(messages=messages, temperature=temperature, stream=False)
@@ -195,6 +382,20 @@ class OllamaLLMModel(LLMModel):
             return response["choices"][0]["message"]["content"]
         return ""
 
+    async def _acompletion(self, prompt, temperature=0.00001):
+        session = get_async_session(self._http_config)
+        if not session:
+            return await super()._acompletion(prompt, temperature=temperature)
+        messages = [{"role": "user", "content": prompt}]
+        response = await session.post(
+            f"{self._base_url}/chat/completions",
+            json=self._chat_params(messages, temperature, False),
+        )
+        response = response.json()
+        if response and len(response["choices"]) > 0:
+            return response["choices"][0]["message"]["content"]
+        return ""
+
     @classmethod
     def support_model(cls, model):
         return True
@@ -207,6 +408,11 @@ class OllamaLLMModel(LLMModel):
     def model_style(cls):
         return ModelStyle.OLLAMA
 
+    @classmethod
+    def default_schedule(cls):
+        # local server, limited by the parallel slots of ollama
+        return {"max_concurrency": 4}
+
 
 @utils.register_model
 class ZhipuAILLMModel(LLMModel):
@@ -247,6 +453,7 @@ class QIANFANLLMModel(LLMModel):
         handle = {k: keys[k] for k in ["QIANFAN_AK", "QIANFAN_SK"]}
         for k, v in handle.items():
             os.environ[k] = v
+        handle["session"] = get_session(config.get("http"))
         return handle
 
     def _embedding(self, text):
@@ -255,7 +462,7 @@ class QIANFANLLMModel(LLMModel):
         )
         payload = json.dumps("")
         headers = {"Content-Type": "application/json", "Accept": "application/json"}
-        response = requests.request("POST", url, headers=headers, data=payload)
+        response = self._handle["session"].post(url, headers=headers, data=payload)
         url = (
             "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/embeddings/embedding-v1?access_token="
             + str(response.json().get("access_token"))
@@ -265,7 +472,7 @@ class QIANFANLLMModel(LLMModel):
         payload = json.dumps({"input": input}, ensure_ascii=False)
         headers = {"Content-Type": "application/json"}
         # send request
-        response = requests.request("POST", url, headers=headers, data=payload)
+        response = self._handle["session"].post(url, headers=headers, data=payload)
         response = json.loads(response.text)
         return response["data"][0]["embedding"]
 
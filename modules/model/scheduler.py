@@ -0,0 +1,208 @@
+"""generative_agents.model.scheduler"""
+
+import time
+import heapq
+import asyncio
+import threading
+import itertools
+import contextlib
+
+
+class Priority:
+    """Priority classes of llm requests, smaller value is served first"""
+
+    CHAT = 0
+    NORMAL = 1
+    BACKGROUND = 2
+
+    NAMES = {CHAT: "chat", NORMAL: "normal", BACKGROUND: "background"}
+
+
+CHAT_CALLERS = (
+    "decide_chat",
+    "decide_chat_terminate",
+    "generate_chat",
+    "generate_chat_check_repeat",
+    "summarize_relation",
+    "summarize_chats",
+)
+
+
+def caller_priority(caller):
+    """Get the priority class of a completion caller"""
+
+    if caller in CHAT_CALLERS:
+        return Priority.CHAT
+    if caller.startswith("poignancy_") or caller.startswith("reflect_"):
+        return Priority.BACKGROUND
+    return Priority.NORMAL
+
+
+class TokenBucket:
+    """Token bucket rate limiter, `rate` requests per second with `burst` capacity"""
+
+    def __init__(self, rate, burst=None):
+        self._rate = rate
+        self._burst = burst or max(rate, 1)
+        self._tokens = self._burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token, return the seconds to wait before using it"""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._stamp) * self._rate)
+            self._stamp = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self._rate
+
+
+class _Waiter:
+    def __init__(self, wake):
+        self.wake = wake
+        self.handed = False
+        self.cancelled = False
+
+
+class BackendQueue:
+    """Priority gate in front of one backend.
+
+    At most `max_concurrency` requests are in flight, waiting requests are
+    served by priority class then arrival order, and an optional token bucket
+    limits the request rate.
+    """
+
+    def __init__(self, name, max_concurrency=4, rate=None, burst=None):
+        self.name = name
+        self._max_concurrency = max_concurrency
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._counter = itertools.count()
+        self._in_flight = 0
+        self._stats = {p: [0, 0.0, 0.0] for p in Priority.NAMES}
+
+    def _try_enter(self, priority, wake):
+        with self._lock:
+            if self._in_flight < self._max_concurrency and not self._waiters:
+                self._in_flight += 1
+                return None
+            waiter = _Waiter(wake)
+            heapq.heappush(self._waiters, (priority, next(self._counter), waiter))
+            return waiter
+
+    def _release(self):
+        with self._lock:
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if not waiter.cancelled:
+                    # hand the slot over, in_flight stays the same
+                    waiter.handed = True
+                    waiter.wake()
+                    return
+            self._in_flight -= 1
+
+    def _record(self, priority, start):
+        waited = time.monotonic() - start
+        with self._lock:
+            stats = self._stats[priority]
+            stats[0] += 1
+            stats[1] += waited
+            stats[2] = max(stats[2], waited)
+
+    @contextlib.contextmanager
+    def slot(self, priority=Priority.NORMAL):
+        start, event = time.monotonic(), threading.Event()
+        if self._try_enter(priority, event.set):
+            event.wait()
+        try:
+            if self._bucket:
+                time.sleep(self._bucket.reserve())
+            self._record(priority, start)
+            yield
+        finally:
+            self._release()
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, priority=Priority.NORMAL):
+        start, loop = time.monotonic(), asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def _wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._try_enter(priority, _wake)
+        if waiter:
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    waiter.cancelled = True
+                if waiter.handed:
+                    self._release()
+                raise
+        try:
+            if self._bucket:
+                await asyncio.sleep(self._bucket.reserve())
+            self._record(priority, start)
+            yield
+        finally:
+            self._release()
+
+    def get_summary(self):
+        with self._lock:
+            des = {"in_flight": self._in_flight, "queued": len(self._waiters)}
+            for p, (count, total, longest) in self._stats.items():
+                if count:
+                    des[Priority.NAMES[p]] = "N:{},W:{:.2f}s/{:.2f}s".format(
+                        count, total / count, longest
+                    )
+        return des
+
+
+_QUEUES = {}
+_QUEUES_LOCK = threading.Lock()
+
+
+def backend_key(style, base_url):
+    """Get the queue key of a backend, the OpenAI compatible /v1 routes of a
+    server share the queue of the server itself"""
+
+    base_url = base_url.rstrip("/")
+    if base_url.endswith("/v1"):
+        base_url = base_url[: -len("/v1")]
+    return "{}:{}".format(style, base_url)
+
+
+def get_queue(backend, config=None):
+    """Get the process-wide queue of a backend.
+
+    Parameters
+    ----------
+    backend: str
+        The backend key, such as the style and base url.
+    config: dict
+        The queue config, keys: max_concurrency, rate, burst.
+
+    Returns
+    -------
+    queue: BackendQueue
+        The shared queue, models of the same backend share the limits.
+    """
+
+    with _QUEUES_LOCK:
+        if backend not in _QUEUES:
+            _QUEUES[backend] = BackendQueue(backend, **(config or {}))
+        return _QUEUES[backend]
+
+
+def get_summary():
+    """Get the queue stats of all backends"""
+
+    with _QUEUES_LOCK:
+        queues = list(_QUEUES.items())
+    return {name: queue.get_summary() for name, queue in queues}
@@ -0,0 +1,130 @@
+"""generative_agents.model.session"""
+
+import asyncio
+import weakref
+import threading
+import importlib.util
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# httpx is optional, the async backends fall back to the sync session without it
+_HAS_HTTPX = importlib.util.find_spec("httpx") is not None
+
+
+class HTTPSession:
+    """Pooled, keep-alive http session shared by the http based backends"""
+
+    def __init__(self, pool_size=16, pool_block=False, timeout=(10, 300), keep_alive=True):
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, pool_block=pool_block
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        if not keep_alive:
+            self._session.headers["Connection"] = "close"
+        if isinstance(timeout, list):
+            timeout = tuple(timeout)
+        self._timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self._timeout)
+        return self._session.request(method, url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _config_key(config):
+    return tuple(
+        (k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(config.items())
+    )
+
+
+def get_session(config=None):
+    """Get the process-wide session for the given pool config.
+
+    Parameters
+    ----------
+    config: dict
+        The session config, keys: pool_size, pool_block, timeout, keep_alive.
+
+    Returns
+    -------
+    session: HTTPSession
+        The shared session, backends with the same config share one pool.
+    """
+
+    config = config or {}
+    key = _config_key(config)
+    with _SESSIONS_LOCK:
+        if key not in _SESSIONS:
+            _SESSIONS[key] = HTTPSession(**config)
+        return _SESSIONS[key]
+
+
+class AsyncHTTPSession:
+    """Pooled, keep-alive async http session, bound to one event loop"""
+
+    def __init__(self, pool_size=16, pool_block=False, timeout=(10, 300), keep_alive=True):
+        import httpx
+
+        if isinstance(timeout, (list, tuple)):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        limits = httpx.Limits(
+            max_connections=pool_size if pool_block else None,
+            max_keepalive_connections=pool_size if keep_alive else 0,
+        )
+        self._client = httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    async def request(self, method, url, **kwargs):
+        return await self._client.request(method, url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+_ASYNC_SESSIONS = weakref.WeakKeyDictionary()
+
+
+def get_async_session(config=None):
+    """Get the async session of the running event loop for the given pool config.
+
+    Parameters
+    ----------
+    config: dict
+        The session config, same as get_session.
+
+    Returns
+    -------
+    session: AsyncHTTPSession
+        The shared async session, None if httpx is not installed.
+    """
+
+    if not _HAS_HTTPX:
+        return None
+    config = config or {}
+    key = _config_key(config)
+    loop = asyncio.get_running_loop()
+    with _SESSIONS_LOCK:
+        sessions = _ASYNC_SESSIONS.setdefault(loop, {})
+        if key not in sessions:
+            sessions[key] = AsyncHTTPSession(**config)
+        return sessions[key]
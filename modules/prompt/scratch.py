@@ -87,6 +87,37 @@ class Scratch:
             "failsafe": random.choice(list(range(10))) + 1,
         }
 
+    def prompt_poignancy_batch(self, items):
+        lines = [
+            "{}. {}：{}".format(
+                idx + 1, "對話" if e_type == "chat" else "事件", event.get_describe()
+            )
+            for idx, (e_type, event) in enumerate(items)
+        ]
+        prompt = self.build_prompt(
+            "poignancy_batch",
+            {
+                "base_desc": self._base_desc(),
+                "agent": self.name,
+                "count": len(items),
+                "events": "\n".join(lines),
+            }
+        )
+
+        def _callback(response):
+            scores = {}
+            for idx, score in parse_llm_output(
+                response, "(\d+)[\.、:：)）]\s*.*?評分[:： ]+(\d{1,2})", "match_all"
+            ):
+                scores[int(idx)] = int(score)
+            assert all(
+                1 <= scores.get(i + 1, 0) <= 10 for i in range(len(items))
+            ), "Missing scores in " + response
+            return [scores[i + 1] for i in range(len(items))]
+
+        # failed batches fall back to scoring one by one
+        return {"prompt": prompt, "callback": _callback, "failsafe": None, "retry": 2}
+
     def prompt_wake_up(self):
         prompt = self.build_prompt(
             "wake_up",
@@ -192,7 +223,8 @@ class Scratch:
             assert len(outputs) >= 5, "less than 5 schedules"
             return {s[0]: s[1] for s in outputs}
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        # retried until the schedule is diverse enough, a cached answer would never change
+        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe, "cache": False}
 
     def prompt_schedule_decompose(self, plan, schedule):
         def _plan_des(plan):
@@ -693,6 +725,7 @@ class Scratch:
             "prompt": prompt,
             "callback": _callback,
             "failsafe": "嗯",
+            "cache": False,
         }
 
     def prompt_generate_chat_check_repeat(self, agent, chats, content):
@@ -0,0 +1,172 @@
+"""generative_agents.storage.checkpoint"""
+
+import os
+import json
+
+from .writer import submit_write, atomic_write
+
+DELETED = "__deleted__"
+
+
+def diff_dict(old, new):
+    """Get the patch turning old into new, nested dicts are patched recursively.
+
+    Parameters
+    ----------
+    old: dict
+        The previous state.
+    new: dict
+        The current state.
+
+    Returns
+    -------
+    patch: dict
+        The changed keys with their new values, removed keys are listed under
+        `__deleted__`.
+    """
+
+    patch = {}
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            sub_patch = diff_dict(old[key], value)
+            if sub_patch:
+                patch[key] = sub_patch
+        elif old[key] != value or type(old[key]) is not type(value):
+            patch[key] = value
+    deleted = [key for key in old if key not in new]
+    if deleted:
+        patch[DELETED] = deleted
+    return patch
+
+
+def apply_patch(state, patch):
+    """Apply a patch from diff_dict to state in place, return the state"""
+
+    for key, value in patch.items():
+        if key == DELETED:
+            for k in value:
+                state.pop(k, None)
+        elif isinstance(value, dict):
+            base = state.get(key)
+            state[key] = apply_patch(base if isinstance(base, dict) else {}, value)
+        else:
+            state[key] = value
+    return state
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _snapshot(data):
+    # copy the containers only, normalized like a json round trip
+    if isinstance(data, dict):
+        return {k: _snapshot(v) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_snapshot(v) for v in data]
+    return data
+
+
+class CheckpointWriter:
+    """Write simulate checkpoints as keyframes and per step deltas.
+
+    A keyframe `simulate-<time>.json` holds the full state, it is written for
+    the first step and then every `keyframe_interval` steps. The steps between
+    are written as `simulate-<time>.delta.json`, holding the patch against the
+    state of the previous step. The files are serialized and written by the
+    background writer of the game when there is one.
+    """
+
+    def __init__(self, folder, keyframe_interval=10):
+        self._folder = folder
+        self._keyframe_interval = keyframe_interval
+        self._last, self._since_keyframe = None, 0
+
+    def write(self, config):
+        """Snapshot the state of one step and queue it for writing"""
+
+        submit_write(self._write, _snapshot(config))
+
+    def _write(self, state):
+        name = "simulate-{}".format(state["time"].replace(":", ""))
+        if self._last is None or self._since_keyframe + 1 >= self._keyframe_interval:
+            path, self._since_keyframe = os.path.join(self._folder, name + ".json"), 0
+            content = _dumps(state)
+        else:
+            path = os.path.join(self._folder, name + ".delta.json")
+            content = _dumps(diff_dict(self._last, state))
+            self._since_keyframe += 1
+        atomic_write(path, content)
+        self._last = state
+
+
+class CheckpointReader:
+    """Read the simulate checkpoints of a folder, keyframes and deltas alike"""
+
+    def __init__(self, folder):
+        self._folder = folder
+        self._files = []
+        if os.path.isdir(folder):
+            names = [
+                f for f in os.listdir(folder)
+                if f.startswith("simulate-") and f.endswith(".json")
+            ]
+            # order by the time part, a keyframe and a delta never share a time
+            self._files = sorted(names, key=lambda f: f.split(".")[0])
+
+    def __len__(self):
+        return len(self._files)
+
+    def __iter__(self):
+        for _, state in self.items():
+            yield state
+
+    def items(self):
+        """Iterate (file name, materialized state) of every step.
+
+        The yielded state is updated in place by the next step, copy it to keep.
+        """
+
+        state = None
+        for name in self._files:
+            data = self._load(name)
+            if self.is_delta(name):
+                if state is None:
+                    # deltas without a leading keyframe can not be materialized
+                    continue
+                state = apply_patch(state, data)
+            else:
+                state = data
+            yield name, state
+
+    def load(self, index=-1):
+        """Materialize the state at the step of index"""
+
+        index = index % len(self._files)
+        start = index
+        while start > 0 and self.is_delta(self._files[start]):
+            start -= 1
+        state = self._load(self._files[start])
+        for name in self._files[start + 1 : index + 1]:
+            state = apply_patch(state, self._load(name))
+        return state
+
+    def latest(self):
+        if not self._files:
+            return None
+        return self.load(-1)
+
+    def _load(self, name):
+        with open(os.path.join(self._folder, name), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def is_delta(name):
+        return name.endswith(".delta.json")
+
+    @property
+    def files(self):
+        return [os.path.join(self._folder, f) for f in self._files]
+
@@ -0,0 +1,80 @@
+"""generative_agents.storage.conversation"""
+
+import os
+import json
+import threading
+
+
+class ConversationLog:
+    """Append-only JSON Lines journal of the chats, one record per chat"""
+
+    def __init__(self, folder, file_name="conversation.jsonl"):
+        self._path = os.path.join(folder, file_name)
+        self._lock = threading.Lock()
+        self._repair()
+
+    def _repair(self, chunk_size=4096):
+        # drop the torn tail of an interrupted run, so new records start on a
+        # line of their own, as load_conversation skips the tail as well
+        if not os.path.exists(self._path):
+            return
+        with open(self._path, "r+b") as f:
+            end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - chunk_size)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < f.seek(0, os.SEEK_END):
+                f.truncate(end)
+
+    def append(self, time, key, chats):
+        record = {"time": time, "key": key, "chats": chats}
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            with open(self._path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    @property
+    def path(self):
+        return self._path
+
+
+def load_conversation(folder):
+    """Load the chats of a simulation.
+
+    Parameters
+    ----------
+    folder: str
+        The checkpoints folder.
+
+    Returns
+    -------
+    conversation: dict
+        The chats as {time: [{"<agent> -> <other> @ <address>": chats}]}, built
+        from the legacy conversation.json followed by the conversation.jsonl.
+    """
+
+    conversation = {}
+    legacy = os.path.join(folder, "conversation.json")
+    if os.path.exists(legacy):
+        with open(legacy, "r", encoding="utf-8") as f:
+            conversation = json.load(f)
+    journal = os.path.join(folder, "conversation.jsonl")
+    if os.path.exists(journal):
+        with open(journal, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # a torn tail of an interrupted run, or a record in writing
+                    break
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    continue
+                conversation.setdefault(record["time"], []).append(
+                    {record["key"]: record["chats"]}
+                )
+    return conversation
@@ -0,0 +1,314 @@
+"""generative_agents.storage.embedding"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from modules.utils import GenerativeAgentsMap, GenerativeAgentsKey
+from modules.model.session import get_session
+from modules.model.scheduler import get_queue, backend_key, Priority
+from modules.model.llm_model import ModelStyle, OllamaLLMModel
+from modules import utils
+
+
+class EmbeddingService:
+    """Embedding service shared by the agents of a game.
+
+    Texts are deduplicated by hash, concurrent requests are merged into micro
+    batches, and the recent embeddings are cached in memory. With a cache
+    folder every embedding is also kept on disk, and the ones evicted from
+    memory are read back from there.
+
+    Parameters
+    ----------
+    embedding: dict
+        The embedding config, keys: type, model, base_url, http, retry,
+        schedule, batch_size, batch_wait, cache_size.
+    path: str
+        The cache folder, None to keep the embeddings in memory only.
+    """
+
+    def __init__(self, embedding, path=None):
+        self._embedding = embedding
+        self._batch_size = embedding.get("batch_size", 32)
+        self._batch_wait = embedding.get("batch_wait", 0)
+        self._cache_size = embedding.get("cache_size", 8192)
+        if embedding["type"] == "hugging_face":
+            from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+            self._handle = HuggingFaceEmbedding(model_name=embedding["model"])
+        elif embedding["type"] == "ollama":
+            self._handle = get_session(embedding.get("http"))
+        else:
+            raise NotImplementedError(
+                "embedding type {} is not supported".format(embedding["type"])
+            )
+        self._retry = utils.create_retry_policy(
+            "embedding:{}".format(embedding.get("base_url", embedding["model"])),
+            embedding.get("retry"),
+        )
+        self._backend_queue = None
+        self._lock = threading.Lock()
+        # the least recently used vectors are evicted first
+        self._vectors = OrderedDict()
+        # key -> row in vectors.bin, the rows are only appended by the leader
+        self._rows, self._num_rows = {}, 0
+        self._pending, self._queue = {}, []
+        self._flushing = False
+        self._summary = {"hit": 0, "miss": 0, "batch": 0}
+        self._path, self._dim = path, None
+        self._saving = bool(path)
+        if path:
+            self._load(path)
+
+    def embed(self, text):
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts):
+        """Embed texts, wait for the requests of the same texts in flight"""
+
+        keys = [self.text_key(t) for t in texts]
+        vectors, rows, futures, lead = {}, {}, {}, False
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in vectors or key in rows or key in futures:
+                    self._summary["hit"] += 1
+                    continue
+                if key in self._vectors:
+                    self._vectors.move_to_end(key)
+                    vectors[key] = self._vectors[key]
+                    self._summary["hit"] += 1
+                    continue
+                if key in self._rows:
+                    rows[key] = self._rows[key]
+                    self._summary["hit"] += 1
+                    continue
+                if key in self._pending:
+                    self._summary["hit"] += 1
+                else:
+                    self._pending[key] = Future()
+                    self._queue.append((key, text))
+                    self._summary["miss"] += 1
+                futures[key] = self._pending[key]
+            if self._queue and not self._flushing:
+                self._flushing, lead = True, True
+        # the first caller flushes the queue for everyone waiting
+        if lead:
+            self._flush()
+        if rows:
+            loaded = dict(zip(rows, self._read_rows(list(rows.values()))))
+            with self._lock:
+                for key, vector in loaded.items():
+                    self._cache(key, vector)
+            vectors.update(loaded)
+        for key, future in futures.items():
+            vectors[key] = future.result()
+        return [vectors[k].tolist() for k in keys]
+
+    def wait_available(self, min_wait=1):
+        """Sleep until the breaker of the backend lets a request through again"""
+
+        time.sleep(max(self._retry.breaker.remaining, min_wait))
+
+    def _flush(self):
+        # texts queued while a batch is in flight are sent with the next batch
+        try:
+            if self._batch_wait > 0:
+                time.sleep(self._batch_wait)
+            while True:
+                with self._lock:
+                    batch = self._queue[: self._batch_size]
+                    self._queue = self._queue[self._batch_size :]
+                    if not batch:
+                        self._flushing = False
+                        return
+                self._flush_batch(batch)
+        except BaseException as e:
+            # fail everything in flight, so no waiter blocks on a dead leader
+            with self._lock:
+                self._flushing, self._queue = False, []
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(e)
+            raise
+
+    def _flush_batch(self, batch):
+        try:
+            vectors = self._retry.run(self._embed_texts, [t for _, t in batch])
+            if len(vectors) != len(batch):
+                raise ValueError(
+                    "got {} embeddings for {} texts".format(len(vectors), len(batch))
+                )
+            vectors = np.asarray(vectors, dtype=np.float32)
+            keys = [k for k, _ in batch]
+            # the disk is written without the lock, the other callers only
+            # wait for it when they need the same texts
+            rows = self._save(keys, vectors)
+            with self._lock:
+                self._summary["batch"] += 1
+                for key, vector in zip(keys, vectors):
+                    self._cache(key, vector)
+                self._rows.update(rows)
+            error = None
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"EmbeddingService.embed() caused an error: {e}")
+            error = e
+        with self._lock:
+            futures = [self._pending.pop(key) for key, _ in batch]
+        for idx, future in enumerate(futures):
+            if error is None:
+                future.set_result(vectors[idx])
+            else:
+                future.set_exception(error)
+
+    def _embed_texts(self, texts):
+        if self._embedding["type"] == "hugging_face":
+            return self._handle.get_text_embedding_batch(texts)
+        # ollama embeds a list of inputs in one request, sharing the request
+        # slots of the llm models on the same server
+        with self._get_backend_queue().slot(Priority.BACKGROUND):
+            response = self._handle.post(
+                "{}/api/embed".format(self._embedding["base_url"]),
+                json={"model": self._embedding["model"], "input": texts},
+            )
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    def _get_backend_queue(self):
+        # resolved on first use, the llm models are created after the agents'
+        # memory and their schedule config should set up the shared queue
+        if self._backend_queue is None:
+            self._backend_queue = get_queue(
+                backend_key(ModelStyle.OLLAMA, self._embedding["base_url"]),
+                {
+                    **OllamaLLMModel.default_schedule(),
+                    **self._embedding.get("schedule", {}),
+                },
+            )
+        return self._backend_queue
+
+    def _cache(self, key, vector):
+        self._vectors[key] = vector
+        self._vectors.move_to_end(key)
+        while len(self._vectors) > self._cache_size:
+            self._vectors.popitem(last=False)
+
+    def _save(self, keys, vectors):
+        if not self._saving:
+            return {}
+        try:
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                utils.save_dict(
+                    {"embedding": self.config_key(self._embedding), "dim": self._dim},
+                    os.path.join(self._path, "embedding.json"),
+                )
+            # append only, the n-th key owns the n-th vector
+            with open(os.path.join(self._path, "vectors.bin"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(os.path.join(self._path, "keys.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(k + "\n" for k in keys))
+        except OSError as e:
+            # a partial append shifts the rows, keep the new embeddings in memory
+            print(f"EmbeddingService failed to save the embeddings, caching in memory only: {e}")
+            self._saving = False
+            return {}
+        rows = {k: self._num_rows + i for i, k in enumerate(keys)}
+        self._num_rows += len(keys)
+        return rows
+
+    def _read_rows(self, rows):
+        size = self._dim * np.dtype(np.float32).itemsize
+        vectors = []
+        with open(os.path.join(self._path, "vectors.bin"), "rb") as f:
+            for row in rows:
+                f.seek(row * size)
+                vectors.append(np.frombuffer(f.read(size), dtype=np.float32))
+        return vectors
+
+    def _load(self, path):
+        os.makedirs(path, exist_ok=True)
+        meta_file = os.path.join(path, "embedding.json")
+        if not os.path.exists(meta_file):
+            return
+        self._dim = utils.load_dict(meta_file)["dim"]
+        keys_file, vectors_file = [os.path.join(path, f) for f in ["keys.txt", "vectors.bin"]]
+        if not os.path.exists(keys_file) or not os.path.exists(vectors_file):
+            return
+        with open(keys_file, "r", encoding="utf-8") as f:
+            keys = f.read().split()
+        size = self._dim * np.dtype(np.float32).itemsize
+        num_vectors = os.path.getsize(vectors_file) // size
+        # drop a partially written tail left by an interrupted run
+        num = min(len(keys), num_vectors)
+        if os.path.getsize(vectors_file) != num * size:
+            os.truncate(vectors_file, num * size)
+        if len(keys) != num:
+            with open(keys_file, "w", encoding="utf-8") as f:
+                f.write("".join(k + "\n" for k in keys[:num]))
+        self._num_rows = num
+        self._rows = {k: i for i, k in enumerate(keys[:num])}
+        # warm the memory cache with the latest embeddings only
+        start = max(num - self._cache_size, 0)
+        vectors = np.fromfile(
+            vectors_file, dtype=np.float32, count=(num - start) * self._dim, offset=start * size
+        ).reshape(-1, self._dim)
+        self._vectors.update(zip(keys[start:num], vectors))
+
+    def get_summary(self):
+        with self._lock:
+            return dict(
+                self._summary, size=max(len(self._rows), len(self._vectors)),
+                cached=len(self._vectors),
+            )
+
+    @property
+    def config(self):
+        return self._embedding
+
+    @staticmethod
+    def text_key(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def config_key(embedding):
+        keys = ["type", "model", "base_url"]
+        config = json.dumps({k: embedding.get(k) for k in keys}, sort_keys=True)
+        return hashlib.sha1(config.encode("utf-8")).hexdigest()[:12]
+
+
+_SERVICES_LOCK = threading.Lock()
+
+
+def create_embedding_service(embedding, root=None):
+    """Create or get the embedding service of the running game.
+
+    Parameters
+    ----------
+    embedding: dict
+        The embedding config.
+    root: str
+        The storage root to keep the embedding cache, None for memory only.
+
+    Returns
+    -------
+    service: EmbeddingService
+        The shared service, agents with the same embedding config share one.
+    """
+
+    key = EmbeddingService.config_key(embedding)
+    with _SERVICES_LOCK:
+        services = GenerativeAgentsMap.get(GenerativeAgentsKey.EMBEDDING)
+        if services is None:
+            services = {}
+            GenerativeAgentsMap.set(GenerativeAgentsKey.EMBEDDING, services)
+        if key not in services:
+            path = os.path.join(root, "embedding", key) if root else None
+            services[key] = EmbeddingService(embedding, path=path)
+        return services[key]
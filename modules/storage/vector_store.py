@@ -0,0 +1,406 @@
+"""generative_agents.storage.vector_store"""
+
+import os
+import json
+import heapq
+
+import numpy as np
+
+from modules import utils
+from .embedding import create_embedding_service
+from .writer import submit_write, atomic_write, append_write
+
+
+class Node:
+    """A stored text with metadata, `score` is set on retrieved copies"""
+
+    def __init__(self, id_, text, metadata, score=None):
+        self.id_ = id_
+        self.text = text
+        self.metadata = metadata
+        self.score = score
+
+    def with_score(self, score):
+        return Node(self.id_, self.text, self.metadata, score=score)
+
+    def to_dict(self):
+        return {"id_": self.id_, "text": self.text, "metadata": dict(self.metadata)}
+
+
+class VectorStore:
+    """Vector store with a contiguous embedding matrix and columnar metadata.
+
+    Embeddings are kept L2 normalized in one float32 matrix, node_type,
+    poignancy and create/expire/access (as epoch seconds) are kept in numpy
+    columns, so similarity search, filtering and cleanup are vectorized.
+    The node API is the one Associate used with LlamaIndex, whose persisted
+    docstore is migrated on first load.
+
+    Changes are persisted append-only: save() appends the nodes added,
+    removed and accessed since the last save to a write-ahead log, and the
+    log is compacted into a new snapshot once it outgrows the store. The
+    files are written by the background writer of the game when there is one.
+    """
+
+    _columns = {
+        "node_type": np.int16,
+        "poignancy": np.float32,
+        "create": np.int64,
+        "expire": np.int64,
+        "access": np.int64,
+    }
+    compact_min = 256
+    # embedding attempts of add_node, each one spends the retry budget and
+    # waits out the breaker cooldown before the next
+    add_attempts = 3
+
+    def __init__(self, embedding, path=None):
+        self._service = create_embedding_service(embedding)
+        self._config = {"max_nodes": 0}
+        self._nodes, self._rows, self._types = [], {}, {}
+        self._vectors, self._size = None, 0
+        self._data = {k: np.zeros(0, dtype=t) for k, t in self._columns.items()}
+        self._path = path
+        self._generation, self._journal, self._wal_size = 0, [], 0
+        # min-heap of (expire, node_id), entries of removed nodes are skipped
+        self._expiry, self._latest_create = [], 0
+        self._snapshotted = False
+        if path and os.path.exists(os.path.join(path, "nodes.json")):
+            self._load(path)
+            self._snapshotted = True
+        elif path and os.path.exists(os.path.join(path, "docstore.json")):
+            self._migrate(path)
+
+    def add_node(self, text, metadata=None, id=None):
+        """Embed and add a node, None if the embedding keeps failing.
+
+        A failed embedding is retried after the breaker cooldown, up to
+        `add_attempts` times, then the node is skipped instead of failing the
+        simulation step.
+        """
+
+        metadata = metadata or {}
+        id = id or "node_" + str(self._config["max_nodes"])
+        for attempt in range(self.add_attempts):
+            try:
+                vector = self._service.embed(text)
+                break
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"VectorStore.add_node() caused an error: {e}")
+                if attempt + 1 >= self.add_attempts:
+                    print(f"VectorStore.add_node() skipped the node: {text}")
+                    return None
+                self._service.wait_available()
+        self._config["max_nodes"] += 1
+        node = Node(id, text, metadata)
+        self._append([node], np.asarray([vector], dtype=np.float32))
+        record = {
+            "op": "add",
+            "node": node.to_dict(),
+            "dim": len(vector),
+            "max_nodes": self._config["max_nodes"],
+        }
+        self._journal.append((record, self._vectors[self._size - 1].copy()))
+        return node
+
+    def has_node(self, node_id):
+        return node_id in self._rows
+
+    def find_node(self, node_id):
+        return self._nodes[self._rows[node_id]]
+
+    def get_nodes(self, filter=None):
+        return [n for n in self._nodes if not filter or filter(n)]
+
+    def remove_nodes(self, node_ids):
+        node_ids = [i for i in node_ids if i in self._rows]
+        if node_ids:
+            self._remove(node_ids)
+            self._journal.append(({"op": "remove", "ids": node_ids}, None))
+
+    def _remove(self, node_ids):
+        rows = [self._rows[i] for i in node_ids]
+        keep = np.ones(self._size, dtype=bool)
+        keep[rows] = False
+        self._nodes = [n for n, k in zip(self._nodes, keep) if k]
+        self._vectors = self._vectors[: self._size][keep]
+        self._data = {k: v[: self._size][keep] for k, v in self._data.items()}
+        self._size = len(self._nodes)
+        self._rows = {n.id_: r for r, n in enumerate(self._nodes)}
+        if len(self._expiry) > 2 * self._size + 64:
+            # drop the entries of the removed nodes
+            self._expiry = [e for e in self._expiry if e[1] in self._rows]
+            heapq.heapify(self._expiry)
+
+    def cleanup(self):
+        """Remove the expired nodes and the ones created after now.
+
+        Expired nodes are popped from the expiry heap, so the cost follows the
+        number of expired nodes. All the nodes are only scanned when the clock
+        is behind the latest create time, as after resuming an earlier time.
+        """
+
+        now = utils.to_epoch(utils.get_timer().get_date())
+        if now < self._latest_create:
+            invalid = (self._column("create") > now) | (self._column("expire") < now)
+            remove_ids = [self._nodes[r].id_ for r in np.flatnonzero(invalid)]
+        else:
+            remove_ids = []
+            while self._expiry and self._expiry[0][0] < now:
+                expire, node_id = heapq.heappop(self._expiry)
+                row = self._rows.get(node_id)
+                if row is not None and self._data["expire"][row] == expire:
+                    remove_ids.append(node_id)
+        self.remove_nodes(remove_ids)
+        if now < self._latest_create:
+            self._latest_create = int(self._column("create").max()) if self._size else 0
+        return remove_ids
+
+    def update_access(self, node_ids, access):
+        """Set the access time of nodes, access is formatted as %Y%m%d-%H:%M:%S"""
+
+        self._set_access(node_ids, access)
+        self._journal.append(({"op": "access", "ids": list(node_ids), "access": access}, None))
+
+    def _set_access(self, node_ids, access):
+        epoch = utils.to_epoch(access)
+        for node_id in node_ids:
+            row = self._rows[node_id]
+            self._nodes[row].metadata["access"] = access
+            self._data["access"][row] = epoch
+
+    def retrieve(self, text, similarity_top_k=5, node_type=None, node_ids=None):
+        rows, scores = self.similarity(text, node_type=node_type, node_ids=node_ids)
+        if similarity_top_k < len(rows):
+            top = np.argpartition(-scores, similarity_top_k - 1)[:similarity_top_k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return self.nodes_at(rows[top], scores[top])
+
+    def similarity(self, text, node_type=None, node_ids=None):
+        """Get the rows of the candidate nodes and their cosine similarity to text.
+
+        The rows are valid until the next removal, see column() and nodes_at().
+        """
+
+        rows, scores = self.similarity_batch([text], node_type=node_type, node_ids=node_ids)
+        return rows, scores[0]
+
+    def similarity_batch(self, texts, node_type=None, node_ids=None):
+        """Get the rows of the candidate nodes and their similarity to every text.
+
+        The texts are embedded in one request and scored with one matrix
+        product, scores[i] holds the similarities of texts[i].
+        """
+
+        if node_ids is not None:
+            rows = np.array([self._rows[i] for i in node_ids if i in self._rows], dtype=int)
+        else:
+            rows = np.arange(self._size)
+        if node_type is not None:
+            code = self._types.get(node_type, -1)
+            rows = rows[self._data["node_type"][rows] == code]
+        if not len(rows) or not texts:
+            return rows, np.zeros((len(texts), len(rows)), dtype=np.float32)
+        try:
+            queries = np.asarray(self._service.embed_batch(list(texts)), dtype=np.float32)
+        except Exception as e:
+            print(f"VectorStore.retrieve() caused an error: {e}")
+            return rows[:0], np.zeros((len(texts), 0), dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries /= np.where(norms > 0, norms, 1)
+        return rows, queries @ self._vectors[rows].T
+
+    def column(self, key, rows):
+        """Get the metadata column of key at rows, create/expire/access as epochs"""
+
+        return self._data[key][rows]
+
+    def nodes_at(self, rows, scores=None):
+        if scores is None:
+            return [self._nodes[r] for r in rows]
+        return [self._nodes[r].with_score(float(s)) for r, s in zip(rows, scores)]
+
+    def save(self, path=None):
+        path = path or self._path
+        if path != self._path:
+            submit_write(self._write_snapshot, path, self._generation + 1, *self._snapshot())
+            return
+        if not self._snapshotted or (
+            self._wal_size + len(self._journal) > max(self._size, self.compact_min)
+        ):
+            self._compact()
+        elif self._journal:
+            self._flush_journal()
+
+    def _flush_journal(self):
+        wal_file = os.path.join(self._path, "wal-{}".format(self._generation))
+        records = [r for r, _ in self._journal]
+        vectors = [v for _, v in self._journal if v is not None]
+        submit_write(self._write_journal, wal_file, records, vectors)
+        self._wal_size += len(self._journal)
+        self._journal = []
+
+    def _compact(self):
+        self._generation += 1
+        self._journal, self._wal_size, self._snapshotted = [], 0, True
+        submit_write(self._write_snapshot, self._path, self._generation, *self._snapshot())
+        submit_write(self._remove_stale, self._path, self._generation)
+
+    def _snapshot(self):
+        data = {"config": dict(self._config), "nodes": [n.to_dict() for n in self._nodes]}
+        vectors = self._vectors[: self._size].copy() if self._vectors is not None else None
+        return data, vectors
+
+    @staticmethod
+    def _write_journal(wal_file, records, vectors):
+        # vectors go first, a record only counts once its line is complete
+        if vectors:
+            append_write(
+                wal_file + ".bin", np.asarray(vectors, dtype=np.float32).tobytes(), "ab"
+            )
+        append_write(
+            wal_file + ".jsonl",
+            "".join(
+                json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n"
+                for r in records
+            ),
+        )
+
+    @staticmethod
+    def _write_snapshot(path, generation, data, vectors):
+        os.makedirs(path, exist_ok=True)
+        if vectors is not None:
+            atomic_write(
+                os.path.join(path, "vectors-{}.npy".format(generation)),
+                lambda f: np.save(f, vectors),
+                "wb",
+            )
+        data["generation"] = generation
+        atomic_write(
+            os.path.join(path, "nodes.json"),
+            json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+        )
+
+    @staticmethod
+    def _remove_stale(path, generation):
+        # files of older generations are covered by the new snapshot
+        current = ["vectors-{}.npy".format(generation), "nodes.json"]
+        for f in os.listdir(path):
+            if f.startswith(("wal-", "vectors")) and f not in current:
+                os.remove(os.path.join(path, f))
+
+    def _load(self, path):
+        data = utils.load_dict(os.path.join(path, "nodes.json"))
+        self._config = data["config"]
+        self._generation = data.get("generation", 0)
+        nodes = [Node(**n) for n in data["nodes"]]
+        if nodes:
+            vectors_file = "vectors-{}.npy".format(self._generation)
+            if "generation" not in data:
+                vectors_file = "vectors.npy"
+            vectors = np.load(os.path.join(path, vectors_file))
+            self._append(nodes, vectors, normalized=True)
+        self._replay(os.path.join(path, "wal-{}".format(self._generation)))
+
+    def _replay(self, wal_file):
+        if not os.path.exists(wal_file + ".jsonl"):
+            return
+        vectors = np.zeros(0, dtype=np.float32)
+        if os.path.exists(wal_file + ".bin"):
+            vectors = np.fromfile(wal_file + ".bin", dtype=np.float32)
+        with open(wal_file + ".jsonl", "rb") as f:
+            content = f.read()
+        offset, valid = 0, 0
+        for line in content.split(b"\n"):
+            try:
+                record = json.loads(line.decode("utf-8"))
+            except ValueError:
+                break
+            if record["op"] == "add" and offset + record["dim"] > len(vectors):
+                break
+            valid += len(line) + 1
+            if record["op"] == "add":
+                vector = vectors[offset : offset + record["dim"]][None]
+                offset += record["dim"]
+                self._append([Node(**record["node"])], vector, normalized=True)
+                self._config["max_nodes"] = record["max_nodes"]
+            elif record["op"] == "remove":
+                self._remove([i for i in record["ids"] if i in self._rows])
+            elif record["op"] == "access":
+                self._set_access(
+                    [i for i in record["ids"] if i in self._rows], record["access"]
+                )
+            self._wal_size += 1
+        # drop the torn tail of an interrupted run, so new records follow valid ones
+        if valid < len(content):
+            with open(wal_file + ".jsonl", "r+b") as f:
+                f.truncate(valid)
+        if offset < len(vectors):
+            with open(wal_file + ".bin", "r+b") as f:
+                f.truncate(offset * 4)
+
+    def _migrate(self, path):
+        """Load the docstore and vector store persisted by LlamaIndex"""
+
+        docstore = utils.load_dict(os.path.join(path, "docstore.json"))
+        nodes = [
+            Node(d["__data__"]["id_"], d["__data__"]["text"], d["__data__"]["metadata"])
+            for d in docstore.get("docstore/data", {}).values()
+        ]
+        vector_file = os.path.join(path, "default__vector_store.json")
+        embeddings = {}
+        if os.path.exists(vector_file):
+            embeddings = utils.load_dict(vector_file).get("embedding_dict", {})
+        missing = [n for n in nodes if n.id_ not in embeddings]
+        if missing:
+            vectors = self._service.embed_batch([n.text for n in missing])
+            embeddings.update({n.id_: v for n, v in zip(missing, vectors)})
+        if nodes:
+            vectors = np.asarray([embeddings[n.id_] for n in nodes], dtype=np.float32)
+            self._append(nodes, vectors)
+        config_file = os.path.join(path, "index_config.json")
+        if os.path.exists(config_file):
+            self._config = utils.load_dict(config_file)
+        else:
+            self._config = {"max_nodes": len(nodes)}
+
+    def _append(self, nodes, vectors, normalized=False):
+        if not normalized:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms > 0, norms, 1)
+        num = self._size + len(nodes)
+        if self._vectors is None:
+            self._vectors = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        if num > len(self._vectors):
+            # grow the capacity geometrically to keep appends amortized O(1)
+            capacity = max(num, 2 * len(self._vectors), 64)
+            self._vectors = self._resize(self._vectors, capacity)
+            self._data = {k: self._resize(v, capacity) for k, v in self._data.items()}
+        self._vectors[self._size : num] = vectors
+        for row, node in enumerate(nodes, self._size):
+            meta = node.metadata
+            code = self._types.setdefault(meta.get("node_type"), len(self._types))
+            self._data["node_type"][row] = code
+            self._data["poignancy"][row] = meta.get("poignancy", 0)
+            for key in ["create", "expire", "access"]:
+                self._data[key][row] = utils.to_epoch(meta[key]) if key in meta else 0
+            self._rows[node.id_] = row
+            heapq.heappush(self._expiry, (int(self._data["expire"][row]), node.id_))
+            self._latest_create = max(self._latest_create, int(self._data["create"][row]))
+        self._nodes.extend(nodes)
+        self._size = num
+
+    def _column(self, key):
+        return self._data[key][: self._size]
+
+    @staticmethod
+    def _resize(array, capacity):
+        resized = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+        resized[: len(array)] = array
+        return resized
+
+    @property
+    def nodes_num(self):
+        return self._size
@@ -0,0 +1,111 @@
+"""generative_agents.storage.writer"""
+
+import os
+import queue
+import atexit
+import threading
+
+from modules.utils import GenerativeAgentsMap, GenerativeAgentsKey
+
+
+def atomic_write(path, content, mode="w", fsync=True):
+    """Write content to a temp file, then rename it over path.
+
+    Parameters
+    ----------
+    path: str
+        The target path.
+    content: str or callable
+        The content to write, or a callable taking the opened file.
+    mode: str
+        The open mode, "w" for text and "wb" for bytes.
+    fsync: bool
+        Whether to flush the file to disk before the rename.
+    """
+
+    tmp_path = path + ".tmp"
+    encoding = None if "b" in mode else "utf-8"
+    with open(tmp_path, mode, encoding=encoding) as f:
+        if callable(content):
+            content(f)
+        else:
+            f.write(content)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def append_write(path, content, mode="a", fsync=True):
+    """Append content to path, flushed to disk when fsync is set"""
+
+    encoding = None if "b" in mode else "utf-8"
+    with open(path, mode, encoding=encoding) as f:
+        f.write(content)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class BackgroundWriter:
+    """Run write jobs in submission order on a background thread.
+
+    The queue is bounded, so submit() blocks when the disk falls behind by
+    more than `max_pending` jobs. Errors of the jobs are raised from the next
+    submit() or drain(). The thread is a daemon, so close() is registered to
+    run at exit and the accepted jobs are written even if nobody drains.
+    """
+
+    def __init__(self, max_pending=64):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, name="checkpoint-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, func, *args, **kwargs):
+        self._raise_error()
+        self._queue.put((func, args, kwargs))
+
+    def drain(self):
+        """Block until all the submitted jobs are done"""
+
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                func, args, kwargs = job
+                func(*args, **kwargs)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"BackgroundWriter caused an error: {e}")
+                self._error = self._error or e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error:
+            error, self._error = self._error, None
+            raise error
+
+
+def submit_write(func, *args, **kwargs):
+    """Run func on the writer of the game, or inline if there is none"""
+
+    writer = GenerativeAgentsMap.get(GenerativeAgentsKey.WRITER)
+    if writer:
+        writer.submit(func, *args, **kwargs)
+    else:
+        func(*args, **kwargs)
@@ -0,0 +1,79 @@
+"""
+Game.agents_think 反應階段測試
+驗證並行時的對話與等待結果和逐一執行時相同
+"""
+
+import os
+import sys
+import time
+import random
+
+# 添加父目錄到路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.game import Game
+
+
+class FakeAgent:
+    """只實作反應階段的 Agent，對話會改變雙方的行動結束時間"""
+
+    def __init__(self, name, reaction=None):
+        self.name = name
+        self.reaction = reaction
+        self.end = 60
+        self.waited = None
+        self.chats = []
+
+    def decide_reaction(self, agents):
+        if not self.reaction:
+            return None
+        mode, other = self.reaction
+        return mode, agents[other], None
+
+    def react(self, mode, other):
+        if mode == "chat":
+            # 讓其他執行緒有機會在對話途中讀取行動
+            time.sleep(random.random() / 100)
+            self.end = other.end = self.end + 30
+            return "09:30", "{} -> {}".format(self.name, other.name), []
+        time.sleep(random.random() / 100)
+        self.waited = other.end
+        return None
+
+    def record_chat(self, key, chat_key, chats):
+        self.chats.append(chat_key)
+
+
+def _run_react(workers):
+    game = Game.__new__(Game)
+    game.think_workers, game._executor = workers, None
+    reactions = {
+        "A": ("wait", "B"),
+        "B": ("chat", "C"),
+        "C": ("chat", "B"),
+        "D": ("wait", "C"),
+        "E": ("chat", "F"),
+        "F": ("wait", "E"),
+        "G": ("wait", "F"),
+        "H": None,
+    }
+    game.agents = {n: FakeAgent(n, r) for n, r in reactions.items()}
+    reacted = game._react(list(game.agents.values()))
+    if game._executor:
+        game._executor.shutdown()
+    return reacted, {
+        n: (a.end, a.waited, a.chats) for n, a in game.agents.items()
+    }
+
+
+def test_react_matches_serial():
+    """測試並行反應的結果與逐一執行相同"""
+    expected = _run_react(1)
+    assert expected[0] == {"B", "E"}
+    # 等待在對話之後執行，看到的是對話後的行動
+    assert expected[1]["A"][1] == 90
+    assert expected[1]["G"][1] == 90
+    # 已在對話中的 Agent 不再等待
+    assert expected[1]["F"][1] is None
+    for _ in range(5):
+        assert _run_react(8) == expected
@@ -4,4 +4,5 @@ from .arguments import *
 from .log import *
 from .namespace import *
 from .register import *
+from .retry import *
 from .timer import *
@@ -42,6 +42,8 @@ class GenerativeAgentsKey:
     GAME = "game"
     TIMER = "timer"
     MODELS = "models"
+    EMBEDDING = "embedding"
+    WRITER = "writer"
 
 
 class ModelType:
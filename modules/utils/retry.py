@@ -0,0 +1,174 @@
+"""generative_agents.utils.retry"""
+
+import time
+import random
+import asyncio
+import threading
+
+
+class CircuitBreaker:
+    """Circuit breaker that fails fast while a backend keeps failing.
+
+    After `threshold` consecutive transport failures the circuit opens and calls
+    are rejected for `cooldown` seconds, then a single probe call is let through.
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._failures = 0
+        self._opened = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened is None:
+                return True
+            if self._probing or time.monotonic() - self._opened < self._cooldown:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures, self._opened, self._probing = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self._threshold:
+                self._opened, self._probing = time.monotonic(), False
+
+    @property
+    def is_open(self):
+        return self._opened is not None
+
+    @property
+    def remaining(self):
+        """Seconds until the open circuit lets a probe through, 0 when closed"""
+
+        with self._lock:
+            if self._opened is None:
+                return 0
+            return max(0, self._cooldown - (time.monotonic() - self._opened))
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected by an open circuit"""
+
+
+class RetryPolicy:
+    """Retry policy with jittered exponential backoff and a bounded time budget.
+
+    Parameters
+    ----------
+    base_delay: float
+        The delay in seconds before the first transport retry.
+    max_delay: float
+        The upper bound of a single delay.
+    budget: float
+        The total seconds a call may spend retrying, <=0 for no budget.
+    breaker: CircuitBreaker
+        The breaker shared by all callers of the same backend.
+    """
+
+    def __init__(self, base_delay=1, max_delay=30, budget=60, breaker=None):
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._budget = budget
+        self.breaker = breaker or CircuitBreaker()
+
+    def _next_delay(self, attempt, start):
+        delay = min(self._max_delay, self._base_delay * 2**attempt)
+        delay *= random.uniform(0.5, 1)
+        if self._budget > 0 and time.monotonic() - start + delay > self._budget:
+            return None
+        return delay
+
+    def backoff(self, attempt, start):
+        """Sleep before the next transport retry, False if the budget is exhausted"""
+
+        delay = self._next_delay(attempt, start)
+        if delay is None:
+            return False
+        time.sleep(delay)
+        return True
+
+    async def abackoff(self, attempt, start):
+        """Async version of backoff"""
+
+        delay = self._next_delay(attempt, start)
+        if delay is None:
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+    def run(self, func, *args, retry=10, **kwargs):
+        """Call func with transport retries, raise the last error when given up"""
+
+        start, error = time.monotonic(), None
+        for attempt in range(retry):
+            if not self.breaker.allow():
+                raise CircuitOpenError("circuit is open, last error: {}".format(error))
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self.breaker.failure()
+                error = e
+                if attempt + 1 < retry and not self.backoff(attempt, start):
+                    break
+                continue
+            self.breaker.success()
+            return result
+        raise error
+
+    async def arun(self, func, *args, retry=10, **kwargs):
+        """Async version of run, func should be a coroutine function"""
+
+        start, error = time.monotonic(), None
+        for attempt in range(retry):
+            if not self.breaker.allow():
+                raise CircuitOpenError("circuit is open, last error: {}".format(error))
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self.breaker.failure()
+                error = e
+                if attempt + 1 < retry and not await self.abackoff(attempt, start):
+                    break
+                continue
+            self.breaker.success()
+            return result
+        raise error
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def create_retry_policy(backend, config=None):
+    """Create retry policy, policies of the same backend share one breaker.
+
+    Parameters
+    ----------
+    backend: str
+        The backend key, such as the base url.
+    config: dict
+        The retry config, keys: base_delay, max_delay, budget, threshold, cooldown.
+
+    Returns
+    -------
+    policy: RetryPolicy
+        The retry policy.
+    """
+
+    config = dict(config or {})
+    breaker_config = {
+        k: config.pop(k) for k in ["threshold", "cooldown"] if k in config
+    }
+    with _BREAKERS_LOCK:
+        if backend not in _BREAKERS:
+            _BREAKERS[backend] = CircuitBreaker(**breaker_config)
+        breaker = _BREAKERS[backend]
+    return RetryPolicy(breaker=breaker, **config)
@@ -1,16 +1,27 @@
 """generative_agents.utils.timer"""
 
 import datetime
+import functools
 
 from .namespace import GenerativeAgentsMap, GenerativeAgentsKey
 
 
+# dates are immutable, so the parsed dates of the repeated strings are shared
+@functools.lru_cache(maxsize=4096)
 def to_date(date_str, date_format="%Y%m%d-%H:%M:%S"):
     if date_format == "%H:%M" and date_str.startswith("24:"):
         date_str = date_str.replace("24:", "0:")
     return datetime.datetime.strptime(date_str, date_format)
 
 
+def to_epoch(date):
+    """Seconds of a naive date since 1970-01-01, independent of the local timezone"""
+
+    if isinstance(date, str):
+        date = to_date(date)
+    return int((date - datetime.datetime(1970, 1, 1)).total_seconds())
+
+
 def daily_duration(date, mode="minute"):
     duration = date.hour % 24
     if mode == "hour":
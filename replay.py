@@ -5,6 +5,8 @@ from datetime import datetime, timedelta
 from flask import Flask, render_template, request
 
 from compress import frames_per_step, file_movement
+from modules.storage.checkpoint import CheckpointReader
+from modules.storage.conversation import load_conversation
 from start import load_personas_from_config
 
 # 載入AI居民列表
@@ -92,25 +94,19 @@ def extract_interaction_data(checkpoints_folder):
     
     print(f"正在提取交互數據，資料夾：{checkpoints_folder}")
     
-    try:
-        checkpoint_files = [f for f in os.listdir(checkpoints_folder) 
-                           if f.startswith("simulate-") and f.endswith(".json")]
-        checkpoint_files.sort()
-        print(f"找到 {len(checkpoint_files)} 個檢查點檔案")
-    except FileNotFoundError:
+    if not os.path.isdir(checkpoints_folder):
         print(f"錯誤：找不到資料夾 {checkpoints_folder}")
         return object_interactions, location_interactions
-    
-    if not checkpoint_files:
+
+    reader = CheckpointReader(checkpoints_folder)
+    print(f"找到 {len(reader)} 個檢查點檔案")
+
+    if len(reader) < 1:
         print("警告：沒有找到任何檢查點檔案")
         return object_interactions, location_interactions
     
-    for checkpoint_file in checkpoint_files:
-        file_path = os.path.join(checkpoints_folder, checkpoint_file)
+    for checkpoint_file, data in reader.items():
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            
             if "agents" not in data:
                 print(f"警告：檔案 {checkpoint_file} 中沒有 agents 數據")
                 continue
@@ -239,12 +235,13 @@ def interaction_graph():
         return f"Invalid name of the simulation: '{name}'"
 
     # 讀取對話數據
-    conversation_file = f"{checkpoint_folder}/conversation.json"
-    if not os.path.exists(conversation_file):
-        return f"The conversation file doesn't exist: '{conversation_file}'"
+    conversation_files = [
+        f"{checkpoint_folder}/conversation.jsonl", f"{checkpoint_folder}/conversation.json"
+    ]
+    if not any(os.path.exists(f) for f in conversation_files):
+        return f"The conversation file doesn't exist: '{conversation_files[0]}'"
 
-    with open(conversation_file, "r", encoding="utf-8") as f:
-        conversation_data = json.load(f)
+    conversation_data = load_conversation(checkpoint_folder)
 
     # 計算角色之間的互動次數和對話長度
     interaction_count = collections.defaultdict(int)  # 互動次數
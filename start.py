@@ -7,6 +7,9 @@ import datetime
 from dotenv import load_dotenv, find_dotenv
 
 from modules.game import create_game, get_game
+from modules.model.scheduler import get_summary as get_llm_queues
+from modules.storage.checkpoint import CheckpointWriter, CheckpointReader
+from modules.storage.conversation import load_conversation
 from modules import utils
 
 # 從配置文件載入AI居民列表，避免硬編碼
@@ -52,14 +55,10 @@ class SimulateServer:
         self.config = config
 
         os.makedirs(checkpoints_folder, exist_ok=True)
+        self.checkpoint_writer = CheckpointWriter(checkpoints_folder)
 
         # 載入歷史對話數據（用於斷點恢复）
-        self.conversation_log = f"{checkpoints_folder}/conversation.json"
-        if os.path.exists(self.conversation_log):
-            with open(self.conversation_log, "r", encoding="utf-8") as f:
-                conversation = json.load(f)
-        else:
-            conversation = {}
+        conversation = load_conversation(checkpoints_folder)
 
         if len(log_file) > 0:
             self.logger = utils.create_file_logger(f"{checkpoints_folder}/{log_file}", verbose)
@@ -91,38 +90,50 @@ class SimulateServer:
 
     def simulate(self, step, stride=0):
         timer = utils.get_timer()
-        for i in range(self.start_step, self.start_step + step):
-            title = "Simulate Step[{}/{}, time: {}]".format(i+1, self.start_step + step, timer.get_date())
-            self.logger.info("\n" + utils.split_line(title, "="))
-            for name, status in self.agent_status.items():
-                plan = self.game.agent_think(name, status)["plan"]
-                agent = self.game.get_agent(name)
-                if name not in self.config["agents"]:
-                    self.config["agents"][name] = {}
-                self.config["agents"][name].update(agent.to_dict())
-                if plan.get("path"):
-                    status["coord"], status["path"] = plan["path"][-1], []
-                self.config["agents"][name].update(
-                    # {"coord": status["coord"], "path": plan["path"]}
-                    {"coord": status["coord"]}
+        # 出錯或中斷時也要寫完已排入佇列的存檔
+        try:
+            for i in range(self.start_step, self.start_step + step):
+                title = "Simulate Step[{}/{}, time: {}]".format(i+1, self.start_step + step, timer.get_date())
+                self.logger.info("\n" + utils.split_line(title, "="))
+                if self.game.think_workers > 1:
+                    results = self.game.agents_think(self.agent_status)
+                else:
+                    results = {
+                        name: self.game.agent_think(name, status)
+                        for name, status in self.agent_status.items()
+                    }
+                queues = get_llm_queues()
+                if queues:
+                    self.logger.info(
+                        "\n{}\n{}\n".format(utils.split_line("LLM Queues"), utils.dump_dict(queues))
+                    )
+                for name, status in self.agent_status.items():
+                    plan = results[name]["plan"]
+                    agent = self.game.get_agent(name)
+                    if name not in self.config["agents"]:
+                        self.config["agents"][name] = {}
+                    self.config["agents"][name].update(agent.to_dict())
+                    if plan.get("path"):
+                        status["coord"], status["path"] = plan["path"][-1], []
+                    self.config["agents"][name].update(
+                        # {"coord": status["coord"], "path": plan["path"]}
+                        {"coord": status["coord"]}
+                    )
+
+                sim_time = timer.get_date("%Y%m%d-%H:%M")
+                self.config.update(
+                    {
+                        "time": sim_time,
+                        "step": i + 1,
+                    }
                 )
+                # 保存Agent活動數據，每隔數步保存完整狀態，其餘只保存變化
+                self.checkpoint_writer.write(self.config)
 
-            sim_time = timer.get_date("%Y%m%d-%H:%M")
-            self.config.update(
-                {
-                    "time": sim_time,
-                    "step": i + 1,
-                }
-            )
-            # 保存Agent活動數據
-            with open(f"{self.checkpoints_folder}/simulate-{sim_time.replace(':', '')}.json", "w", encoding="utf-8") as f:
-                f.write(json.dumps(self.config, indent=2, ensure_ascii=False))
-            # 保存對話數據
-            with open(f"{self.checkpoints_folder}/conversation.json", "w", encoding="utf-8") as f:
-                f.write(json.dumps(self.game.conversation, indent=2, ensure_ascii=False))
-
-            if stride > 0:
-                timer.forward(stride)
+                if stride > 0:
+                    timer.forward(stride)
+        finally:
+            self.game.shutdown()
 
     def load_static(self, path):
         return utils.load_dict(os.path.join(self.static_root, path))
@@ -130,19 +141,10 @@ class SimulateServer:
 
 # 從存檔數據總載入配置，用於斷點恢复
 def get_config_from_log(checkpoints_folder):
-    files = sorted(os.listdir(checkpoints_folder))
-
-    json_files = list()
-    for file_name in files:
-        if file_name.endswith(".json") and file_name != "conversation.json":
-            json_files.append(os.path.join(checkpoints_folder, file_name))
-
-    if len(json_files) < 1:
+    config = CheckpointReader(checkpoints_folder).latest()
+    if config is None:
         return None
 
-    with open(json_files[-1], "r", encoding="utf-8") as f:
-        config = json.load(f)
-
     assets_root = os.path.join("assets", "village")
 
     start_time = datetime.datetime.strptime(config["time"], "%Y%m%d-%H:%M")
@@ -189,6 +191,7 @@ parser.add_argument("--step", type=int, default=10, help="The simulate step")
 parser.add_argument("--stride", type=int, default=10, help="The step stride in minute")
 parser.add_argument("--verbose", type=str, default="debug", help="The verbose level")
 parser.add_argument("--log", type=str, default="", help="Name of the log file")
+parser.add_argument("--workers", type=int, default=0, help="Number of agents thinking concurrently, 0 or 1 to think one by one")
 args = parser.parse_args()
 
 
@@ -221,6 +224,7 @@ if __name__ == "__main__":
         sim_config = get_config(start_time, args.stride, personas)
         start_step = 0
 
+    sim_config["think_workers"] = args.workers
     static_root = "frontend/static"
 
     server = SimulateServer(name, static_root, checkpoints_folder, sim_config, start_step, args.verbose, args.log)
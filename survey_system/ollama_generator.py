@@ -8,12 +8,13 @@ Uses local Ollama LLM to generate contextual survey responses based on:
 
 import os
 import json
-import requests
 from typing import Dict, List, Optional, Any
 from pathlib import Path
 from string import Template
 from dotenv import load_dotenv
 
+from modules.model.session import get_session
+
 load_dotenv()
 
 
@@ -34,6 +35,10 @@ class OllamaSurveyGenerator:
 
         # Set paths
         self.project_root = Path(__file__).parent.parent
+
+        # Pooled keep-alive session with the http config of the simulation
+        # backends, it is the same pool when both run in one process
+        self.session = get_session(self._load_http_config())
         self.prompts_dir = self.project_root / "data" / "prompts"
 
         # Set agents directory
@@ -51,6 +56,21 @@ class OllamaSurveyGenerator:
         # Cache for agent data
         self.agents_cache = {}
 
+    def _load_http_config(self) -> Dict[str, Any]:
+        """
+        Load the http pool config of the simulation LLM backends.
+
+        Returns:
+            The think.llm.config.http section of data/config.json, empty if missing
+        """
+        config_path = self.project_root / "data" / "config.json"
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            return config["agent"]["think"]["llm"].get("config", {}).get("http", {})
+        except (OSError, ValueError, KeyError):
+            return {}
+
     def _load_agent_data(self, agent_name: str) -> Optional[Dict[str, Any]]:
         """
         Load agent data from agent.json file.
@@ -276,7 +296,7 @@ class OllamaSurveyGenerator:
 
         # Call Ollama API
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.api_url,
                 json={
                     "model": self.model,